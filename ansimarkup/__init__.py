@@ -1,12 +1,31 @@
-from .markup import AnsiMarkup, AnsiMarkupError, MismatchedTag, UnbalancedTag
+import sys
 
+from .markup import AnsiMarkup, AnsiMarkupAlias, AnsiMarkupCachedTag, AnsiMarkupError, MismatchedTag, UnbalancedTag
+from .markup import AnsiMarkupRawString
 
-_ansimarkup = AnsiMarkup()
-parse = _ansimarkup.parse
-strip = _ansimarkup.strip
-ansiprint = _ansimarkup.ansiprint
-ansistring = _ansimarkup.ansistring
-raw = _ansimarkup.rawstring_cls
+
+raw = AnsiMarkupRawString
+alias = AnsiMarkupAlias
+cached = AnsiMarkupCachedTag
+
+# The default instance is created when one of its methods is first used.
+_default_methods = ("parse", "strip", "ansiprint", "ansistring")
+
+
+def __getattr__(name):
+    if name not in _default_methods and name != "_ansimarkup":
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    global _ansimarkup
+    _ansimarkup = AnsiMarkup()
+    for method in _default_methods:
+        globals()[method] = getattr(_ansimarkup, method)
+    return globals()[name]
+
+
+# Module __getattr__() needs Python 3.7 - earlier versions create the default instance right away.
+if sys.version_info < (3, 7):
+    __getattr__("_ansimarkup")
 
 
 __all__ = (
@@ -19,4 +38,6 @@ __all__ = (
     "ansiprint",
     "ansistring",
     "raw",
+    "alias",
+    "cached",
 )
@@ -1,25 +1,90 @@
-from sys import argv, stdin, stdout, exit
-from . import ansiprint, parse
+import sys
+from argparse import ArgumentParser
+from codecs import getincrementaldecoder
+from textwrap import dedent
 
+from . import AnsiMarkup, AnsiMarkupError
 
-if len(argv) == 1 and stdin.isatty():
-    from textwrap import dedent
 
-    usage = """
-    Usage: python -m ansimarkup [<arg> [<arg> ...]]
+usage = """
+Usage: python -m ansimarkup [--strip] [--strict] [--tag-sep <chars>] [--color <when>] [<arg> [<arg> ...]]
 
-    Example usage:
-      python -m ansimarkup '<b>Bold</b>' '<r>Red</r>'
-      python -m ansimarkup '<b><r>Bold Red</r></b>'
-      python -m ansimarkup < input-with-markup.txt
-      echo '<b>Bold</b>' | python -m ansimarkup
+Example usage:
+  python -m ansimarkup '<b>Bold</b>' '<r>Red</r>'
+  python -m ansimarkup '<b><r>Bold Red</r></b>'
+  python -m ansimarkup < input-with-markup.txt
+  echo '<b>Bold</b>' | python -m ansimarkup
+  python -m ansimarkup --strip < input-with-markup.txt > plain.txt
+  python -m ansimarkup --color auto < input-with-markup.txt | tee output.txt
+
+Options:
+  --strip            remove markup tags instead of converting them
+  --strict           fail if opening tags have no corresponding closing tags
+  --tag-sep <chars>  opening and closing characters of each tag (default: <>)
+  --color <when>     write escape codes always (default), never or when
+                     standard output is a terminal (auto)
+"""
+
+# Standard input is read and standard output is written in blocks of this size.
+block_size = 1 << 18
+
+
+def pipe(am: AnsiMarkup, infile, outfile, strip=False, encoding="utf-8", errors="surrogateescape"):
     """
+    Copy markup from a binary input to a binary output file. Open tags stay
+    open across lines and blocks.
+    """
+    decoder = getincrementaldecoder(encoding)(errors)
+    stream = am.stream(strip=strip)
+
+    # Unlike read(), read1() returns whatever is available, which keeps
+    # interactive pipes (e.g. tail -f) responsive.
+    read = getattr(infile, "read1", infile.read)
+
+    while True:
+        block = read(block_size)
+        if not block:
+            break
+        res = stream.feed(decoder.decode(block))
+        if res:
+            outfile.write(res.encode(encoding, errors))
+            outfile.flush()
+
+    res = stream.feed(decoder.decode(b"", final=True)) + stream.close()
+    outfile.write(res.encode(encoding, errors))
+    outfile.flush()
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="python -m ansimarkup", add_help=False)
+    parser.add_argument("--strip", action="store_true")
+    parser.add_argument("--strict", action="store_true")
+    parser.add_argument("--tag-sep", default="<>")
+    parser.add_argument("--color", default="always")
+    parser.add_argument("-h", "--help", action="store_true")
+    parser.add_argument("args", nargs="*")
+    opts = parser.parse_args(argv)
+
+    if opts.help or (not opts.args and sys.stdin.isatty()):
+        print(dedent(usage).strip())
+        return 0
+
+    try:
+        am = AnsiMarkup(strict=opts.strict, tag_sep=opts.tag_sep, color=opts.color)
+        if opts.strip:
+            # Stripping is the same as never writing escape codes.
+            am.color = "never"
+        if opts.args:
+            am.ansiprint(*opts.args)
+        else:
+            strip = not am.colors(sys.stdout)
+            pipe(am, sys.stdin.buffer, sys.stdout.buffer, strip, sys.stdout.encoding or "utf-8")
+    except (AnsiMarkupError, ValueError) as error:
+        print("ansimarkup: error: %s" % error, file=sys.stderr)
+        return 1
+
+    return 0
 
-    print(dedent(usage).strip())
-    exit(0)
 
-if not stdin.isatty():
-    for line in stdin:
-        stdout.write(parse(line))
-else:
-    ansiprint(*argv[1:])
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Write markup to asyncio streams without blocking the event loop on large
+payloads.
+"""
+
+import asyncio
+from concurrent.futures import Executor
+from typing import Optional
+
+from . import markup
+
+
+class AnsiMarkupWriter:
+    """
+    Parse markup incrementally and write the result to an asyncio stream
+    writer, or to any object with a ``write()`` method and an awaitable
+    ``drain()`` method. Example usage::
+
+      >>> reader, writer = await asyncio.open_connection(host, port)
+      >>> out = AnsiMarkupWriter(writer)
+      >>> await out.write('<b>bold ')
+      >>> await out.write('still bold</b>')
+      >>> await out.close()
+
+    Open tags are kept across writes. Output is buffered until batch_size
+    characters have accumulated, after which it is written and drained,
+    which makes writes wait while the stream applies backpressure. Payloads
+    are parsed batch_size characters at a time, so that other tasks can run
+    in between. Payloads of at least executor_threshold characters are
+    parsed in executor (the default executor of the loop, if None) instead.
+
+    The output is encoded with encoding, unless it is None, in which case
+    strings are written.
+    """
+
+    def __init__(
+        self,
+        writer,
+        ansimarkup: Optional[markup.AnsiMarkup] = None,
+        encoding: Optional[str] = "utf-8",
+        errors: str = "strict",
+        batch_size: int = 1 << 16,
+        executor_threshold: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        strip: bool = False,
+    ):
+        self.writer = writer
+        self.ansimarkup = ansimarkup if ansimarkup else markup.AnsiMarkup()
+        self.encoding = encoding
+        self.errors = errors
+        self.batch_size = batch_size
+        self.executor_threshold = executor_threshold
+        self.executor = executor
+        self.stream = self.ansimarkup.stream(strip=strip)
+        self.buffer = []
+        self.buffered = 0
+        self.lock = asyncio.Lock()
+
+    async def write(self, text: str):
+        """Parse markup and write the output once a batch is complete."""
+        async with self.lock:
+            await self._feed(text)
+
+    async def ansiprint(self, *args: str, sep: str = " ", end: str = "\n"):
+        """Same as ``ansiprint()``, but writes to the stream."""
+        raw = self.ansimarkup.rawstring_cls
+        async with self.lock:
+            for i, arg in enumerate(args):
+                if i:
+                    await self._feed(raw(sep))
+                await self._feed(arg if isinstance(arg, str) else str(arg))
+            await self._feed(raw(end))
+
+    async def drain(self):
+        """Write the buffered output and wait until the stream has room for more."""
+        async with self.lock:
+            await self._drain()
+
+    async def close(self):
+        """
+        Write the remaining output, apply the strict and always_reset options
+        and close the stream writer.
+        """
+        try:
+            async with self.lock:
+                self._append(self.stream.close())
+                await self._drain()
+        finally:
+            # The writer is closed even if the markup is invalid.
+            self.writer.close()
+            if hasattr(self.writer, "wait_closed"):
+                await self.writer.wait_closed()
+
+    async def __aenter__(self) -> "AnsiMarkupWriter":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _feed(self, text: str):
+        feed, size = self.stream.feed, self.batch_size
+        if isinstance(text, self.ansimarkup.rawstring_cls) or len(text) <= size:
+            chunks = (text,)
+        else:
+            text = str.__str__(text)
+            chunks = (text[i : i + size] for i in range(0, len(text), size))
+
+        if self.executor_threshold is not None and len(text) >= self.executor_threshold:
+            loop = asyncio.get_event_loop()
+            for chunk in chunks:
+                self._append(await loop.run_in_executor(self.executor, feed, chunk))
+                if self.buffered >= size:
+                    await self._drain()
+            return
+
+        for i, chunk in enumerate(chunks):
+            if i:
+                # Let other tasks run between the chunks of a large payload.
+                await asyncio.sleep(0)
+            self._append(feed(chunk))
+            if self.buffered >= size:
+                await self._drain()
+
+    def _append(self, res: str):
+        if res:
+            self.buffer.append(res)
+            self.buffered += len(res)
+
+    async def _drain(self):
+        if self.buffer:
+            res = "".join(self.buffer)
+            self.buffer, self.buffered = [], 0
+            self.writer.write(res.encode(self.encoding, self.errors) if self.encoding else res)
+        await self.writer.drain()
@@ -1,14 +1,66 @@
-from colorama.ansi import AnsiCodes
-from colorama import Fore, Back, Style
+# Static tables of the escape codes that ansimarkup uses. They match the
+# values of the corresponding colorama constants, without importing colorama.
 
 
-class AnsiExtendedStyle(AnsiCodes):
-    ITALIC = 3
-    UNDERLINE = 4
-    BLINK = 5
-    REVERSE = 7
-    HIDE = 8
-    STRIKE = 9
+class AnsiFore:
+    BLACK = "\033[30m"
+    RED = "\033[31m"
+    GREEN = "\033[32m"
+    YELLOW = "\033[33m"
+    BLUE = "\033[34m"
+    MAGENTA = "\033[35m"
+    CYAN = "\033[36m"
+    WHITE = "\033[37m"
+    RESET = "\033[39m"
 
+    LIGHTBLACK_EX = "\033[90m"
+    LIGHTRED_EX = "\033[91m"
+    LIGHTGREEN_EX = "\033[92m"
+    LIGHTYELLOW_EX = "\033[93m"
+    LIGHTBLUE_EX = "\033[94m"
+    LIGHTMAGENTA_EX = "\033[95m"
+    LIGHTCYAN_EX = "\033[96m"
+    LIGHTWHITE_EX = "\033[97m"
 
+
+class AnsiBack:
+    BLACK = "\033[40m"
+    RED = "\033[41m"
+    GREEN = "\033[42m"
+    YELLOW = "\033[43m"
+    BLUE = "\033[44m"
+    MAGENTA = "\033[45m"
+    CYAN = "\033[46m"
+    WHITE = "\033[47m"
+    RESET = "\033[49m"
+
+    LIGHTBLACK_EX = "\033[100m"
+    LIGHTRED_EX = "\033[101m"
+    LIGHTGREEN_EX = "\033[102m"
+    LIGHTYELLOW_EX = "\033[103m"
+    LIGHTBLUE_EX = "\033[104m"
+    LIGHTMAGENTA_EX = "\033[105m"
+    LIGHTCYAN_EX = "\033[106m"
+    LIGHTWHITE_EX = "\033[107m"
+
+
+class AnsiStyle:
+    BRIGHT = "\033[1m"
+    DIM = "\033[2m"
+    NORMAL = "\033[22m"
+    RESET_ALL = "\033[0m"
+
+
+class AnsiExtendedStyle:
+    ITALIC = "\033[3m"
+    UNDERLINE = "\033[4m"
+    BLINK = "\033[5m"
+    REVERSE = "\033[7m"
+    HIDE = "\033[8m"
+    STRIKE = "\033[9m"
+
+
+Fore = AnsiFore()
+Back = AnsiBack()
+Style = AnsiStyle()
 ExtendedStyle = AnsiExtendedStyle()
@@ -0,0 +1,115 @@
+"""
+Opt-in counters and timings for an AnsiMarkup instance. Instrumentation
+shadows the instrumented methods with instance attributes, so that an
+instance that is not instrumented runs exactly the same code as before.
+"""
+
+from collections import Counter, namedtuple
+from time import perf_counter
+from typing import Callable, Optional
+
+from .tags import all_tags
+
+
+Stats = namedtuple("Stats", ["calls", "chars_in", "chars_out", "tags", "cache_hits", "cache_misses", "time"])
+
+# The methods whose calls are counted and timed.
+methods = ("parse", "strip", "ansistring")
+
+# The categories that tags are counted in.
+categories = ("user", "all_tags", "extended", "shorthand", "unknown")
+
+SlowHook = Callable[[str, tuple, float], None]
+
+
+class Instrumentation:
+    """
+    Collect statistics about the calls to an AnsiMarkup instance. Calls that
+    take at least slow_threshold seconds are reported to on_slow with the name
+    of the method, its arguments and the time they took.
+    """
+
+    def __init__(self, am, slow_threshold: Optional[float] = None, on_slow: Optional[SlowHook] = None):
+        self.ansimarkup = am
+        self.slow_threshold = slow_threshold
+        self.on_slow = on_slow
+        self.clear()
+
+    def clear(self):
+        self.calls = Counter()
+        self.tags = Counter()
+        self.chars_in = self.chars_out = 0
+        self.time = 0.0
+        self.cache_base = (self.ansimarkup._cache_hits, self.ansimarkup._cache_misses)
+
+    def stats(self) -> Stats:
+        am = self.ansimarkup
+        return Stats(
+            calls={name: self.calls[name] for name in methods},
+            chars_in=self.chars_in,
+            chars_out=self.chars_out,
+            tags={name: self.tags[name] for name in categories},
+            cache_hits=am._cache_hits - self.cache_base[0],
+            cache_misses=am._cache_misses - self.cache_base[1],
+            time=self.time,
+        )
+
+    def install(self):
+        am = self.ansimarkup
+        for name in methods:
+            setattr(am, name, self.wrap(name, getattr(type(am), name).__get__(am)))
+        am._sub = self.wrap_sub(type(am)._sub.__get__(am))
+        # The scan engine strips without a callback per tag, so strip() uses
+        # the regex engine, which calls the counting _clear().
+        am._clear = self.wrap_sub(type(am)._clear.__get__(am))
+        am._strip = am._strip_regex
+
+    def uninstall(self):
+        am = self.ansimarkup
+        for name in methods + ("_sub", "_clear", "_strip"):
+            am.__dict__.pop(name, None)
+        if am.engine == "regex":
+            am._strip = am._strip_regex
+            self.ansimarkup.__dict__.pop(name, None)
+
+    def wrap(self, name: str, method: Callable) -> Callable:
+        def instrumented(*args, **kwargs):
+            # Calls that raise are counted and timed too.
+            start = perf_counter()
+            try:
+                res = method(*args, **kwargs)
+                # The len() of an AnsiMarkupString is its visible length.
+                self.chars_out += sum(map(str.__len__, res)) if isinstance(res, list) else str.__len__(res)
+                return res
+            finally:
+                elapsed = perf_counter() - start
+                self.calls[name] += 1
+                self.time += elapsed
+                self.chars_in += sum(len(i) for i in args)
+                if self.slow_threshold is not None and elapsed >= self.slow_threshold and self.on_slow:
+                    self.on_slow(name, args, elapsed)
+
+        instrumented.__doc__ = method.__doc__
+        return instrumented
+
+    def wrap_sub(self, sub: Callable) -> Callable:
+        am, tags = self.ansimarkup, self.tags
+
+        def instrumented(markup, tag, stack):
+            res = sub(markup, tag, stack)
+            if markup[1] != "/":
+                known = am._tag_table.get(tag, am._shared_table.get(tag)) is not None
+                tags[self.category(tag) if known else "unknown"] += 1
+            return res
+
+        return instrumented
+
+    def category(self, tag: str) -> str:
+        """Return the category of a known tag, in the order in which AnsiMarkup.resolve_tag() checks them."""
+        if tag in self.ansimarkup._user_codes:
+            return "user"
+        if tag in all_tags:
+            return "all_tags"
+        if tag.startswith("fg ") or tag.startswith("bg "):
+            return "extended"
+        return "shorthand"
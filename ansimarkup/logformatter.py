@@ -1,18 +1,278 @@
+import re
 import sys
+import copy
 import logging
+from logging.handlers import QueueHandler
+from types import SimpleNamespace
+from weakref import WeakKeyDictionary
 
 from . import markup
 
 
+# Field references for each of the format styles that logging supports, with
+# the name of the field in the first group that matches and its conversion
+# specifier (if any) in the last group. Escaped specials match with no groups.
+field_patterns = {
+    logging.PercentStyle: re.compile(r"%%|%\((\w+)\)([#0+ -]*(?:\*|\d+)?(?:\.(?:\*|\d+))?[diouxefgcrsa%])"),
+    logging.StrFormatStyle: re.compile(r"\{\{|\}\}|\{(\w+)((?:![rsa])?(?::[^{}]*)?)\}"),
+    logging.StringTemplateStyle: re.compile(r"\$\$|\$(\w+)()|\$\{(\w+)()\}"),
+}
+
+# The conversion specifier of a field that is substituted as-is.
+plain_specs = {logging.PercentStyle: "s", logging.StrFormatStyle: "", logging.StringTemplateStyle: ""}
+
+
 class AnsiMarkupFormatter(logging.Formatter):
-    def __init__(self, *args, **kwargs):
+    """
+    Logging formatter that converts the markup in the format string and in
+    the logged messages to escape codes.
+
+    The markup in the format string is converted once, when the formatter is
+    created. For every record, only the fields listed in markup_fields are
+    parsed - the values of all other fields are inserted as they are.
+    """
+
+    def __init__(self, *args, markup_fields=("message", "msg"), **kwargs):
         self.ansimarkup = markup.AnsiMarkup()
-        super(AnsiMarkupFormatter, self).__init__(*args)
+        self.markup_fields = markup_fields
+        super(AnsiMarkupFormatter, self).__init__(*args, **kwargs)
+        try:
+            self.template = self.compile_template()
+        except markup.AnsiMarkupError:
+            # Let every record raise the error, as it did before.
+            self.template = None
+
+    def compile_template(self):
+        """
+        Convert the markup in the format string. Returns None if the records
+        have to be formatted and parsed as a whole.
+        """
+        am, style = self.ansimarkup, self._style
+        pattern = field_patterns.get(type(style))
+        if pattern is None or am.minimal:
+            return None
+
+        opening, closing = am.tag_sep
+        fmt, pos, parts, plain, fields = style._fmt, 0, [], [], []
+        stack = markup.TagStack()
+
+        for match in pattern.finditer(fmt):
+            groups = [i for i in match.groups() if i is not None]
+            if not groups:
+                continue
+            name, spec = groups
+
+            # A field inside of a tag (e.g. '<fg %(color)s>') forms the tag
+            # only after the record has been formatted.
+            before, after = fmt[: match.start()], fmt[match.end() :]
+            open_at, close_at = after.find(opening), after.find(closing)
+            if before.rfind(opening) > before.rfind(closing) and close_at != -1 and not 0 <= open_at < close_at:
+                return None
+
+            if name not in self.markup_fields:
+                continue
+            if spec != plain_specs[type(style)] or name in (i[0] for i in fields):
+                return None
+
+            am._render(fmt[pos : match.start()], am._sub, stack, parts)
+            parts.append(match.group(0))
+            plain.extend((am.strip(fmt[pos : match.start()]), match.group(0)))
+            fields.append((name, stack.copy()))
+            pos = match.end()
+
+        am._render(fmt[pos:], am._sub, stack, parts)
+        plain.append(am.strip(fmt[pos:]))
+
+        # The escape codes of user tags could contain characters that are
+        # special to the format style.
+        specials = [i.group(0) for i in pattern.finditer(fmt)]
+        styles = []
+        for compiled in "".join(parts), "".join(plain):
+            if [i.group(0) for i in pattern.finditer(compiled)] != specials:
+                return None
+            try:
+                styles.append(type(style)(compiled, defaults=getattr(style, "_defaults", None)))
+            except TypeError:
+                styles.append(type(style)(compiled))
+
+        return styles[0], styles[1], fields, stack
 
     def format(self, record):
+        if self.template is not None:
+            message = self.format_compiled(record)
+            if message is not None:
+                return message
+
         message = super(AnsiMarkupFormatter, self).format(record)
         message = self.ansimarkup.parse(message)
         return message
 
+    def format_plain(self, record):
+        """Format a record with all markup removed."""
+        if self.template is not None:
+            message = self.format_compiled(record, strip=True)
+            if message is not None:
+                return message
+
+        message = super(AnsiMarkupFormatter, self).format(record)
+        message = self.ansimarkup.strip(message)
+        return message
+
+    def format_compiled(self, record, strip=False):
+        """
+        Format a record using the compiled format string. Returns None if the
+        markup in a field does not leave the tags of the format string as it
+        found them, in which case the record has to be parsed as a whole.
+        """
+        am = self.ansimarkup
+        style, plain_style, fields, end = self.template
+
+        record.message = record.getMessage()
+        if self.usesTime():
+            record.asctime = self.formatTime(record, self.datefmt)
+
+        values = dict(record.__dict__)
+        for name, context in fields:
+            if name not in values:
+                return None
+            value = values[name] = self.format_field(record, name, str(values[name]), context, strip)
+            if value is None:
+                return None
+
+        message = (plain_style if strip else style).format(SimpleNamespace(**values))
+
+        # Same as logging.Formatter.format(), but the exception and stack
+        # information are parsed in the context of the format string.
+        suffix = ""
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text or record.stack_info:
+            # The separators depend on the message with its markup, which the
+            # parsed and stripped messages may end differently than.
+            last = self._style.format(record)[-1:]
+            if record.exc_text:
+                suffix = record.exc_text if last == "\n" else "\n" + record.exc_text
+                last = suffix[-1:]
+            if record.stack_info:
+                if last != "\n":
+                    suffix += "\n"
+                suffix += self.formatStack(record.stack_info)
+
+        if strip:
+            return message + am.strip(suffix)
+
+        stack = end
+        if suffix:
+            stack, parts = end.copy(), [message]
+            am._render(suffix, am._sub, stack, parts)
+            message = "".join(parts)
+
+        return am._finish([message], stack.tags, False)
+
+    def format_field(self, record, name, value, context, strip):
+        """
+        Convert the markup in the value of a field. Returns None if it cannot
+        be converted in the context of the format string.
+        """
+        am = self.ansimarkup
+
+        # The compiled message is shared by all formatters that use equivalent
+        # ansimarkup instances.
+        if name == "message" and (strip or not context):
+            try:
+                compiled = record_markup(am, record)
+            except markup.AnsiMarkupError:
+                compiled = None
+            if compiled is not None and not compiled.dynamic:
+                if strip:
+                    return compiled.strip()
+                if not compiled.open_tags:
+                    return "".join(compiled.segments)
+
+        if strip:
+            return am.strip(value)
+
+        stack, parts = context.copy(), []
+        try:
+            am._render(value, am._sub, stack, parts)
+        except markup.AnsiMarkupError:
+            return None
+        if stack != context:
+            return None
+        return "".join(parts)
+
+
+# The compiled messages of records that are still alive. They are kept off
+# the records, which have to stay picklable (e.g. for SocketHandler).
+record_cache = WeakKeyDictionary()
+
+
+def record_markup(am, record):
+    """
+    Return the compiled markup of the message of a record. The result is
+    cached per record, so that it is parsed only once for all handlers whose
+    ansimarkup instances have the same tags.
+    """
+    key = am if am._user_tags else am.tag_sep
+    cache = record_cache.get(record)
+    if cache is None:
+        cache = record_cache[record] = {}
+
+    compiled = cache.get(key)
+    if compiled is None or compiled.markup != record.message:
+        compiled = cache[key] = am.compile(record.message)
+    return compiled
+
+
+class AnsiMarkupStreamHandler(logging.StreamHandler):
+    """
+    Stream handler that converts markup to escape codes when the stream is a
+    terminal and strips it otherwise (see ``markup.stream_colors()``). The
+    stream is checked once, when it is set, unless colors is given explicitly.
+
+    Records are formatted by the handler's formatter. If it is an
+    AnsiMarkupFormatter, its ansimarkup instance is used for both parsing and
+    stripping.
+    """
+
+    def __init__(self, stream=None, colors=None):
+        super(AnsiMarkupStreamHandler, self).__init__(stream)
+        self.ansimarkup = markup.AnsiMarkup()
+        self.force_colors = colors
+        self.colors = markup.stream_colors(self.stream) if colors is None else colors
+
+    def setStream(self, stream):
+        res = super(AnsiMarkupStreamHandler, self).setStream(stream)
+        if self.force_colors is None:
+            self.colors = markup.stream_colors(self.stream)
+        return res
+
+    def format(self, record):
+        formatter = self.formatter or logging._defaultFormatter
+        if isinstance(formatter, AnsiMarkupFormatter):
+            if self.colors:
+                return formatter.format(record)
+            return formatter.format_plain(record)
+
+        message = formatter.format(record)
+        if self.colors:
+            return self.ansimarkup.parse(message)
+        return self.ansimarkup.strip(message)
+
+
+class AnsiMarkupQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves all formatting to the handlers of the
+    QueueListener. The logging thread only merges the arguments into the
+    message and puts the record on the queue - markup is parsed and the
+    exception is formatted on the listener's thread.
+
+    As records keep their exc_info, the queue must not cross process
+    boundaries. Use logging.handlers.QueueHandler with multiprocessing queues.
+    """
 
-# TODO: Add stream handler that strips tags when the output stream is not a tty.
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        return record
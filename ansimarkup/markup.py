@@ -1,10 +1,53 @@
+import os
 import re
+import sys
 import builtins
-from typing import Callable, List, Match, Optional, Mapping, Pattern, Sequence, Type, Union, Tuple
+from time import monotonic
+from bisect import bisect_left, bisect_right
+from weakref import WeakKeyDictionary
+from collections import OrderedDict, namedtuple
+from functools import partial
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Match,
+    Optional,
+    Mapping,
+    Pattern,
+    Sequence,
+    Type,
+    Union,
+    Tuple,
+)
+
+from .ansi import Style
+from .tags import style, background, foreground, all_tags
+from . import sgr
+from .sgr import SgrRenderer
+from .instrument import Instrumentation, SlowHook, Stats
 
-from colorama import Style
+try:
+    from functools import cached_property
+except ImportError:  # Python < 3.8
 
-from .tags import style, background, foreground, all_tags
+    class cached_property:
+        """Compute an attribute on first access and store it on the instance."""
+
+        def __init__(self, func):
+            self.func = func
+            self.__doc__ = func.__doc__
+
+        def __set_name__(self, owner, name):
+            self.name = name
+
+        def __get__(self, instance, owner=None):
+            if instance is None:
+                return self
+            res = instance.__dict__[self.name] = self.func(instance)
+            return res
 
 
 class AnsiMarkupError(Exception):
@@ -19,14 +62,60 @@ class UnbalancedTag(AnsiMarkupError):
     pass
 
 
+_unresolved = object()
+
+# The user tags and shared tag table of instances that have none. Never modified.
+_no_tags: Dict[str, str] = {}
+
+# Stand in for the results of callable and cached user tags while aliases are expanded.
+_dynamic = "\0dynamic\0"
+_cached = "\0cached\0"
+
 UserTagsType = Mapping[str, Union[str, Callable[[], str]]]
 
+SubType = Callable[[str, str, "TagStack"], str]
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+_reset_bytes = Style.RESET_ALL.encode("ascii")
+
+color_modes = ("always", "never", "auto")
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+def stream_colors(stream) -> bool:
+    """
+    Return True if escape codes should be written to stream. The NO_COLOR and
+    FORCE_COLOR environment variables take precedence, a dumb terminal (TERM)
+    gets no colors and otherwise the stream has to be a terminal.
+    """
+    if os.environ.get("NO_COLOR"):
+        return False
+    force = os.environ.get("FORCE_COLOR")
+    if force:
+        return force != "0"
+    if os.environ.get("TERM") == "dumb":
+        return False
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
 
 class AnsiMarkup:
     """
     Produce colored terminal text with a tag-based markup.
     """
 
+    # Maximum number of tag names whose resolved escape codes are remembered.
+    tag_table_size = 1024
+
+    # Instance state that is only set once it is needed. Keeping the initial
+    # values on the class makes instances cheaper to create.
+    _cache = _cached_values = _tags_deadline = _instrumentation = _stream_colors = None
+    _cache_hits = _cache_misses = _dynamic_calls = _generation = 0
+
     def __init__(
         self,
         tags: Optional[UserTagsType] = None,
@@ -35,13 +124,18 @@ class AnsiMarkup:
         tag_sep: Sequence[str] = "<>",
         ansistring_cls: Optional[Type[str]] = None,
         rawstring_cls: Optional[Type[str]] = None,
+        cache_size: int = 0,
+        engine: str = "scan",
+        minimal: bool = False,
+        color: str = "always",
     ):
         """
         Parameters
         ----------
         tags: dict
            User-supplied tags, which are a mapping of tag names to the strings
-           they will be substituted with.
+           they will be substituted with. Tags wrapped in ``alias()`` are
+           markup that is expanded when they are first used.
         always_reset: bool
            Whether or not ``parse()`` should always end strings with a reset code.
         strict: bool
@@ -52,33 +146,296 @@ class AnsiMarkup:
            String subtype to use in the ``ansistring()`` method.
         rawstring_cls: type
            Strign subtype to use to designate raw strings.
+        cache_size: int
+           Number of compiled markup strings that ``parse()`` keeps in its LRU
+           cache. The cache is disabled if this is 0.
+        engine: str
+           The tokenizer to use - ``scan`` (default) looks for tags with
+           ``str.find``, while ``regex`` uses ``re.finditer``.
+        minimal: bool
+           Whether or not ``parse()`` should only emit the attributes that
+           change between runs of text, merged into a single escape sequence.
+        color: str
+           Whether ``ansiprint()`` writes escape codes - ``always`` (default),
+           ``never`` or ``auto``, which checks each output stream once (see
+           ``stream_colors()``). Markup is stripped when colors are off.
         """
 
-        self.user_tags = tags if tags else {}
+        self.cache_size = cache_size
+
         self.always_reset = always_reset
         self.strict = strict
         self.tag_sep = tag_sep
         self.ansistring_cls = ansistring_cls if ansistring_cls else AnsiMarkupString
         self.rawstring_cls = self.raw = rawstring_cls if rawstring_cls else AnsiMarkupRawString
 
-        self.re_tag = self.compile_tag_regex(tag_sep)
+        check_tag_sep(tag_sep)
+
+        # The scan engine is the default of the class, which saves binding its methods.
+        if engine == "regex":
+            self._render, self._strip = self._render_regex, self._strip_regex
+        elif engine != "scan":
+            raise ValueError('engine needs to be one of "scan" or "regex"')
+        self.engine = engine
+        self.minimal = minimal
+
+        if color not in color_modes:
+            raise ValueError('color needs to be one of "always", "never" or "auto"')
+        self.color = color
+
+        # The user tags are flattened when a tag is first looked up.
+        self._user_tags, self._tags_snapshot = tags, None
+        self._user_codes = _no_tags if tags is None else None
+        self._set_tag_tables()
+
+    @property
+    def user_tags(self) -> UserTagsType:
+        """
+        The mapping of user tags, as it was given. Changes to it take effect
+        the next time markup is parsed.
+        """
+        if self._user_tags is None:
+            self.user_tags = {}
+        return self._user_tags
+
+    @user_tags.setter
+    def user_tags(self, tags: UserTagsType):
+        self._user_tags = tags
+        self._invalidate()
+
+    def _flatten_user_tags(self):
+        """
+        Expand the markup of alias tags into escape codes, so that they cost
+        as little to use as built-in tags. Aliases that refer to callable tags
+        become callables themselves.
+        """
+        tags = self._user_tags
+        aliases = {name: value for name, value in tags.items() if isinstance(value, AnsiMarkupAlias)}
+        if not aliases:
+            # Without aliases, the user tags are their own escape codes, and
+            # changes to them are seen by the next lookup.
+            self._user_codes = tags
+            self._set_tag_tables()
+            if type(self).resolve_tag is not AnsiMarkup.resolve_tag:
+                self._tags_snapshot = dict(tags)
+            return
+
+        # Callables are not called while the aliases are expanded - a marker
+        # stands in for their result.
+        codes = {}
+        for name, value in tags.items():
+            if isinstance(value, AnsiMarkupCachedTag):
+                codes[name] = _cached
+            elif callable(value):
+                codes[name] = _dynamic
+            elif name not in aliases:
+                codes[name] = value
+        self._user_codes, self._tags_snapshot = codes, dict(tags)
+        path = []
+
+        # Tags used by aliases are not counted by instrumentation.
+        sub_tag = type(self)._sub
+
+        def sub(markup, tag, stack):
+            if tag in aliases and tag not in codes:
+                expand(tag)
+            return sub_tag(self, markup, tag, stack)
+
+        def expand(name):
+            if name in path:
+                cycle = path[path.index(name) :] + [name]
+                raise ValueError("user tag aliases refer to each other: %s" % " -> ".join(cycle))
+
+            path.append(name)
+            out = []
+            try:
+                self._render(aliases[name], sub, TagStack(), out)
+            except AnsiMarkupError as error:
+                raise ValueError('user tag alias "%s": %s' % (name, error)) from error
+            path.pop()
+            codes[name] = "".join(out)
+
+        self._set_tag_tables()
+        try:
+            for name in aliases:
+                if name not in codes:
+                    expand(name)
+
+            for name, value in tags.items():
+                if name not in aliases:
+                    codes[name] = value
+                elif _dynamic in codes[name]:
+                    codes[name] = partial(self._render_alias, value)
+                elif _cached in codes[name]:
+                    codes[name] = AnsiMarkupCachedTag(partial(self._render_alias, value))
+        except ValueError:
+            self._user_codes = self._tags_snapshot = None
+            raise
+        finally:
+            self._set_tag_tables()
+
+    def _render_alias(self, markup: str) -> str:
+        out = []
+        self._render(markup, self._sub, TagStack(), out)
+        return "".join(out)
 
     def parse(self, *strings: str, aslist: bool = False) -> str:
         """Return a string with markup tags converted to ansi-escape sequences."""
-        tags, results, res = [], [], []
+        if self._tags_snapshot is not None or self._tags_deadline is not None:
+            self._check_tags()
+        if self.cache_size and len(strings) == 1 and not isinstance(strings[0], self.rawstring_cls):
+            return self._parse_cached(strings[0], aslist)
+        return self._parse(strings, aslist)
 
-        def re_sub(m):
-            return self.sub_tag(m, tags, results)
+    def _parse(self, strings: Sequence[str], aslist: bool):
+        stack, res = TagStack(), []
+        sgr = SgrRenderer() if self.minimal else None
 
         for _str in strings:
             if isinstance(_str, self.rawstring_cls):
                 res.append(_str)
             else:
-                res.append(self.re_tag.sub(re_sub, _str))
+                parts = []
+                self._render(_str, self._sub, stack, parts)
+                res.append(sgr.render(parts) if sgr else "".join(parts))
 
-        if self.strict and tags:
-            markup = "%s%s%s" % (self.tag_sep[0], tags.pop(0), self.tag_sep[1])
-            raise MismatchedTag('opening tag "%s" has no corresponding closing tag' % markup)
+        return self._finish(res, stack.tags, aslist)
+
+    def compile(self, markup: str) -> "CompiledMarkup":
+        """Parse markup ahead of time into a reusable ``CompiledMarkup`` object."""
+        self._check_tags()
+        if self._tags_snapshot is None and self._user_tags is not None:
+            # Compiled markup goes stale when the user tags change.
+            self._tags_snapshot = dict(self._user_tags)
+        stack, segments = TagStack(), []
+        dynamic_calls = self._dynamic_calls
+
+        self._render(markup, self._sub, stack, segments)
+
+        # Markup that uses callable user tags has to be re-parsed on every render.
+        dynamic = dynamic_calls != self._dynamic_calls
+        return CompiledMarkup(self, markup, segments, stack.tags, dynamic)
+
+    def template(self, fmt: str) -> "MarkupTemplate":
+        """
+        Compile markup with ``str.format()`` placeholders into a reusable
+        ``MarkupTemplate``. Values substituted for the placeholders are
+        inserted as-is, like raw strings.
+        """
+        return MarkupTemplate(self, fmt)
+
+    def cache_info(self) -> CacheInfo:
+        """Return the hits, misses, maximum and current size of the parse cache."""
+        currsize = len(self._cache) if self._cache else 0
+        return CacheInfo(self._cache_hits, self._cache_misses, self.cache_size, currsize)
+
+    def cache_clear(self):
+        """Clear the parse cache and its statistics."""
+        self._invalidate()
+        self._cache_hits = self._cache_misses = 0
+
+    def instrument(self, enabled: bool = True, slow_threshold: Optional[float] = None, on_slow: SlowHook = None):
+        """
+        Start (or restart) collecting the statistics that ``stats()`` returns.
+        Calls that take at least slow_threshold seconds are reported to
+        ``on_slow(method_name, args, seconds)``. Instrumentation has no
+        overhead while it is disabled.
+        """
+        if self._instrumentation:
+            self._instrumentation.uninstall()
+            self._instrumentation = None
+
+        if enabled:
+            self._instrumentation = Instrumentation(self, slow_threshold, on_slow)
+            self._instrumentation.install()
+
+    def stats(self) -> Stats:
+        """
+        Return the calls to parse(), strip() and ansistring(), the characters
+        they took and returned, the tags parsed by category, the parse cache
+        hits and misses and the total time spent since ``instrument()``.
+        """
+        if not self._instrumentation:
+            raise ValueError("instrumentation is not enabled - call instrument() first")
+        return self._instrumentation.stats()
+
+    def refresh_tags(self):
+        """
+        Discard the results of cached user tags. Compiled markup that uses
+        them is recompiled the next time it is rendered.
+        """
+        self._invalidate()
+
+    def _invalidate(self):
+        # Called whenever a change to the user tags makes resolved tags and compiled markup stale.
+        if self._cache:
+            self._cache.clear()
+        if self._cached_values:
+            self._cached_values.clear()
+        self._user_codes = _no_tags if self._user_tags is None else None
+        self._tags_snapshot = None
+        self._set_tag_tables()
+        self._tags_deadline = None
+        self._generation += 1
+
+    def _set_tag_tables(self):
+        # Tags are looked up in _tag_table and then in _shared_table. Unless
+        # resolve_tag() is overridden, the resolved built-in tags are shared and
+        # an instance only has its own table for its user tags. Until they are
+        # flattened, every lookup misses.
+        if self._user_codes is None:
+            self._tag_table = self._shared_table = _no_tags
+        elif type(self).resolve_tag is not AnsiMarkup.resolve_tag:
+            self._tag_table, self._shared_table = {}, _no_tags
+        elif self._user_codes is not _no_tags:
+            self._tag_table, self._shared_table = self._user_codes, builtin_tag_table
+        else:
+            self._tag_table, self._shared_table = builtin_tag_table, _no_tags
+
+    def _check_tags(self):
+        # The user tags are compared with a copy, since a mapping cannot tell
+        # whether it has changed. Of the cached user tags, only the earliest
+        # deadline is checked.
+        if self._tags_snapshot is not None and self._tags_snapshot != self._user_tags:
+            self._invalidate()
+        elif self._tags_deadline is not None and self._tags_deadline <= monotonic():
+            self.refresh_tags()
+
+    def _call_cached_tag(self, tag: "AnsiMarkupCachedTag") -> str:
+        values = self._cached_values
+        if values is None:
+            values = self._cached_values = {}
+        elif tag in values:
+            return values[tag]
+
+        res = values[tag] = tag.func()
+        if tag.ttl is not None:
+            deadline = monotonic() + tag.ttl
+            if self._tags_deadline is None or deadline < self._tags_deadline:
+                self._tags_deadline = deadline
+        return res
+
+    def _parse_cached(self, markup: str, aslist: bool):
+        cache = self._cache
+        if cache is None:
+            cache = self._cache = OrderedDict()
+        compiled = cache.get(markup)
+
+        if compiled is None:
+            self._cache_misses += 1
+            compiled = cache[markup] = self.compile(markup)
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+            # Freshly compiled markup is valid for this call, even if it is dynamic.
+            return self._finish([compiled.text], list(compiled.open_tags), aslist)
+
+        self._cache_hits += 1
+        cache.move_to_end(markup)
+        return compiled.render(aslist)
+
+    def _finish(self, res: List[str], tags: List[str], aslist: bool):
+        self._check_closed(tags)
 
         if self.always_reset:
             if not res[-1] == Style.RESET_ALL:
@@ -88,17 +445,227 @@ class AnsiMarkup:
             return res
         return "".join(res)
 
+    def _check_closed(self, tags: List[str]):
+        if self.strict and tags:
+            markup = "%s%s%s" % (self.tag_sep[0], tags[0], self.tag_sep[1])
+            raise MismatchedTag('opening tag "%s" has no corresponding closing tag' % markup)
+
+    def parse_bytes(self, data: BytesLike, out: Optional[bytearray] = None, encoding: str = "utf-8") -> bytearray:
+        """
+        Same as ``parse()``, but for bytes, bytearray or memoryview data. The
+        text between tags is copied as-is, without being decoded. The output
+        is appended to out, which is created if not given, and returned. The
+        encoding of data must be ASCII-compatible (e.g. UTF-8 or Latin-1).
+        """
+        self._check_tags()
+        out = bytearray() if out is None else out
+        start, stack, segments = len(out), TagStack(), []
+        self._render_bytes(data, self._sub, stack, segments, encoding)
+        self._check_closed(stack.tags)
+
+        if self.minimal:
+            segments = SgrRenderer().render_parts(segments)
+        for segment in segments:
+            out += segment.encode(encoding) if isinstance(segment, str) else segment
+
+        if self.always_reset and out[start:] != _reset_bytes:
+            out += _reset_bytes
+        return out
+
+    def strip_bytes(self, data: BytesLike, out: Optional[bytearray] = None, encoding: str = "utf-8") -> bytearray:
+        """
+        Same as ``strip()``, but for bytes, bytearray or memoryview data. The
+        output is appended to out, which is created if not given, and returned.
+        """
+        self._check_tags()
+        out = bytearray() if out is None else out
+        segments = []
+        self._render_bytes(data, self._clear, None, segments, encoding)
+        for segment in segments[::2]:
+            out += segment
+        return out
+
+    def _render_bytes(self, data: BytesLike, sub: SubType, stack: "TagStack", out: list, encoding: str):
+        """
+        Append alternating runs of text (as memoryview slices of data) and tag
+        substitutions (as str) to out. Only tags are decoded.
+        """
+        view, pos = memoryview(data), 0
+        for match in self.re_tag_bytes.finditer(view):
+            try:
+                markup, tag = match.group(0).decode(encoding), match.group(1).decode(encoding)
+            except UnicodeDecodeError:
+                continue
+
+            res = sub(markup, tag, stack)
+            if res is not markup:
+                out.append(view[pos : match.start()])
+                out.append(res)
+                pos = match.end()
+        out.append(view[pos:])
+
+    @cached_property
+    def re_tag_bytes(self) -> Pattern:
+        # The same grammar as re_tag, which only works for ASCII tag separators.
+        if not all(ord(i) < 128 for i in self.tag_sep):
+            raise ValueError("parse_bytes() and strip_bytes() need ASCII tag separators")
+        return re.compile(self.re_tag.pattern.encode("ascii"))
+
     def ansiprint(self, *args: str, **kwargs):
-        """Wrapper around builtins.print() that runs parse() on all arguments first."""
+        """
+        Wrapper around builtins.print() that runs parse() on all arguments
+        first, or strip() if the output is not colored (see ``colors()``).
+        In strict mode, stripped markup is checked the same way as parsed markup.
+        """
 
         new_args = (str(i) if not isinstance(i, str) else i for i in args)
-        parts = self.parse(*new_args, aslist=True)
+        if self.colors(kwargs.get("file")):
+            parts = self.parse(*new_args, aslist=True)
+        elif self.strict:
+            parts = self._strip_strict(new_args)
+        else:
+            parts = [i if isinstance(i, self.rawstring_cls) else self.strip(i) for i in new_args]
         builtins.print(*parts, **kwargs)
 
+    def _strip_strict(self, strings: Iterable[str]) -> List[str]:
+        self._check_tags()
+        stack, res = TagStack(), []
+        for _str in strings:
+            if isinstance(_str, self.rawstring_cls):
+                res.append(_str)
+            else:
+                parts = []
+                self._render(_str, self._clear_strict, stack, parts)
+                res.append("".join(parts))
+
+        self._check_closed(stack.tags)
+        return res
+
+    def colors(self, stream=None) -> bool:
+        """
+        Return whether output to stream (default: ``sys.stdout``) is colored.
+        In the ``auto`` color mode, each stream is checked once.
+        """
+        if self.color != "auto":
+            return self.color == "always"
+
+        stream = sys.stdout if stream is None else stream
+        if self._stream_colors is None:
+            self._stream_colors = WeakKeyDictionary()
+        try:
+            return self._stream_colors[stream]
+        except KeyError:
+            res = self._stream_colors[stream] = stream_colors(stream)
+            return res
+        except TypeError:
+            # The stream cannot be weakly referenced.
+            return stream_colors(stream)
+
     def strip(self, text: str):
         """Return string with markup tags removed."""
-        tags, results = [], []
-        return self.re_tag.sub(lambda m: self.clear_tag(m, tags, results), text)
+        if self._tags_snapshot is not None:
+            self._check_tags()
+        return self._strip(text)
+
+    def parse_many(
+        self,
+        strings: Iterable[str],
+        workers: Optional[int] = None,
+        executor: str = "process",
+        chunksize: int = 256,
+    ) -> List[str]:
+        """
+        Return the result of ``parse()`` for each string, computed in a pool
+        of worker processes or threads. Results are in the same order as the
+        input and identical strings are only parsed once.
+
+        Parameters
+        ----------
+        strings: iterable
+           The markup strings to parse. Raw strings are handled in the calling process.
+        workers: int
+           Number of workers (default: the number of CPUs).
+        executor: str
+           Either ``process`` or ``thread``.
+        chunksize: int
+           Number of strings that are sent to a worker at once.
+        """
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        self._check_tags()
+        strings = list(strings)
+        unique = list(dict.fromkeys(i for i in strings if not isinstance(i, self.rawstring_cls)))
+
+        if executor == "process":
+            pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.config(),))
+            parse = _parse_worker
+        elif executor == "thread":
+            pool = ThreadPoolExecutor(workers)
+            parse = self._parse_chunk
+        else:
+            raise ValueError('executor needs to be one of "process" or "thread"')
+
+        # Chunks are formed here, since ThreadPoolExecutor.map() ignores chunksize.
+        chunks = [unique[i : i + chunksize] for i in range(0, len(unique), chunksize)]
+        with pool:
+            results = dict(zip(unique, (res for chunk in pool.map(parse, chunks) for res in chunk)))
+
+        return [self._parse_one(i) if isinstance(i, self.rawstring_cls) else results[i] for i in strings]
+
+    def config(self) -> dict:
+        """
+        Return the keyword arguments that create an instance with the same
+        configuration. Raises ValueError if there are callable user tags.
+        """
+        if any(callable(i) for i in self.user_tags.values()):
+            raise ValueError("callable user tags cannot be passed to other processes")
+
+        return {
+            "tags": dict(self.user_tags),
+            "always_reset": self.always_reset,
+            "strict": self.strict,
+            "tag_sep": self.tag_sep,
+            "engine": self.engine,
+            "minimal": self.minimal,
+        }
+
+    def _parse_one(self, markup: str) -> str:
+        # Bypasses the parse cache, which is not safe to share between threads.
+        return self._parse((markup,), aslist=False)
+
+    def _parse_chunk(self, chunk: List[str]) -> List[str]:
+        return [self._parse_one(i) for i in chunk]
+
+    def stream(self, max_tag_length: int = 256, strip: bool = False) -> "AnsiMarkupStream":
+        """
+        Return an incremental parser that keeps open tags across chunks of
+        markup. If strip is true, the parser removes tags like ``strip()``.
+        """
+        return AnsiMarkupStream(self, max_tag_length, strip)
+
+    def iterparse(self, markup: Union[str, Iterable[str]], chunk_size: int = 1 << 16) -> Iterator[str]:
+        """
+        Yield the result of ``parse()`` in pieces, for a string or an iterable
+        of strings (e.g. a file). Open tags are kept across pieces and a long
+        string is parsed chunk_size characters at a time, which keeps memory
+        use bounded. The pieces can be passed to ``file.writelines()``.
+        """
+        if isinstance(markup, str):
+            if isinstance(markup, self.rawstring_cls):
+                markup = (markup,)
+            else:
+                text = str.__str__(markup)
+                markup = (text[i : i + chunk_size] for i in range(0, len(text), chunk_size))
+
+        stream = self.stream()
+        for chunk in markup:
+            res = stream.feed(chunk)
+            if res:
+                yield res
+
+        res = stream.close()
+        if res:
+            yield res
 
     def ansistring(self, markup: str):
         return self.ansistring_cls(self, markup)
@@ -106,66 +673,95 @@ class AnsiMarkup:
     def __call__(self, text: str):
         return self.parse(text)
 
-    def sub_tag(self, match: Match, tag_list: List[str], res_list: List[str]) -> str:
-        markup, tag = match.group(0), match.group(1)
+    def _render_scan(self, text: str, sub: SubType, stack: "TagStack", out: List[str]):
+        """
+        Tokenize text with str.find() and append alternating runs of text and
+        tag substitutions to out. Unknown tags are left in the text runs.
+        """
+        opening, closing = self.tag_sep[0], self.tag_sep[1]
+
+        # Fast path for text without any tags.
+        if opening not in text:
+            out.append(text)
+            return
+
+        # Subclasses of str (e.g. AnsiMarkupString) may slice differently.
+        if text.__class__ is not str:
+            text = str.__str__(text)
+
+        find = text.find
+        pos = 0
+        start = find(opening)
+
+        while start != -1:
+            end = find(closing, start + 1)
+            if end == -1:
+                break
+
+            # An opening character inside the tag means that it can only start there.
+            nested = find(opening, start + 1, end)
+            if nested != -1:
+                start = nested
+                continue
+
+            markup = text[start : end + 1]
+            if markup[1] == "/":
+                # A closing tag without a name (i.e. "</>") is named "/".
+                tag = markup[2:-1] or "/"
+            else:
+                tag = markup[1:-1]
+                if not tag:
+                    start = find(opening, end)
+                    continue
+
+            res = sub(markup, tag, stack)
+            if res is not markup:
+                out.append(text[pos:start])
+                out.append(res)
+                pos = end + 1
+            start = find(opening, end + 1)
+
+        out.append(text[pos:])
+
+    def _render_regex(self, text: str, sub: SubType, stack: "TagStack", out: List[str]):
+        """Same as _render_scan(), but tokenizes with the compiled tag regex."""
+        if text.__class__ is not str:
+            text = str.__str__(text)
+        pos = 0
+        for match in self.re_tag.finditer(text):
+            markup = match.group(0)
+            res = sub(markup, match.group(1), stack)
+            if res is not markup:
+                out.append(text[pos : match.start()])
+                out.append(res)
+                pos = match.end()
+        out.append(text[pos:])
+
+    def sub_tag(self, match: Match, stack: "TagStack") -> str:
+        return self._sub(match.group(0), match.group(1), stack)
+
+    def _sub(self, markup: str, tag: str, stack: "TagStack") -> str:
         closing = markup[1] == "/"
-        res = None
 
         # Debug:
-        # print(f"{markup=} {tag=} {tag_list=} {res_list=}")
+        # print(f"{markup=} {tag=} {stack.tags=}")
 
         # Early exit if the closing tag matches the last known opening tag.
-        if closing and tag_list and tag_list[-1] == tag:
-            tag_list.pop()
-            res_list.pop()
-            return Style.RESET_ALL + "".join(res_list)
+        if closing:
+            tags = stack.tags
+            if tags and tags[-1] == tag:
+                return stack.pop()
 
-        # User-defined tags take preference over all other.
-        if tag in self.user_tags:
-            user_tag = self.user_tags[tag]
-            res = user_tag() if callable(user_tag) else user_tag
-
-        # Substitute on a direct match.
-        elif tag in all_tags:
-            res = all_tags[tag]
-
-        # An alternative syntax for setting the color (e.g. <fg red>, <bg red>).
-        elif tag.startswith("fg ") or tag.startswith("bg "):
-            st, color = tag[:2], tag[3:]
-            code = "38" if st == "fg" else "48"
-
-            if st == "fg" and color in foreground:
-                res = foreground[color]
-            elif st == "bg" and color.islower() and color.upper() in background:
-                res = background[color.upper()]
-            elif color.isdigit() and int(color) <= 255:
-                res = "\033[%s;5;%sm" % (code, color)
-            elif re.match(r"#(?:[a-fA-F0-9]{3}){1,2}$", color):
-                hex_color = color[1:]
-                if len(hex_color) == 3:
-                    r, g, b = hex_color
-                    hex_color = r * 2 + g * 2 + b * 2
-                res = "\033[%s;2;%s;%s;%sm" % ((code,) + hex_to_rgb(hex_color))
-            elif color.count(",") == 2:
-                colors = tuple(color.split(","))
-                if all(x.isdigit() and int(x) <= 255 for x in colors):
-                    res = "\033[%s;2;%s;%s;%sm" % ((code,) + colors)
-
-        # Shorthand formats (e.g. <red,blue>, <bold,red,blue>).
-        elif "," in tag:
-            el_count = tag.count(",")
-
-            if el_count == 1:
-                fg, bg = tag.split(",")
-                if fg in foreground and bg.islower() and bg.upper() in background:
-                    res = foreground[fg] + background[bg.upper()]
-
-            elif el_count == 2:
-                st, fg, bg = tag.split(",")
-                if st in style and (fg != "" or bg != ""):
-                    if fg == "" or fg in foreground:
-                        if bg == "" or (bg.islower() and bg.upper() in background):
-                            res = style[st] + foreground.get(fg, "") + background.get(bg.upper(), "")
+        res = self._tag_table.get(tag, _unresolved)
+        if res is _unresolved:
+            res = self._resolve_new_tag(tag)
+
+        if callable(res):
+            if res.__class__ is AnsiMarkupCachedTag:
+                res = self._call_cached_tag(res)
+            else:
+                self._dynamic_calls += 1
+                res = res()
 
         # If nothing matches, return the full tag (i.e. <unknown>text</...>).
         if res is None:
@@ -173,32 +769,130 @@ class AnsiMarkup:
 
         # If closing tag is known, but did not early exit, something is wrong.
         if closing:
-            if tag in tag_list:
+            if tag in stack.counts:
                 raise UnbalancedTag('closing tag "%s" violates nesting rules.' % markup)
             else:
                 raise MismatchedTag('closing tag "%s" has no corresponding opening tag' % markup)
 
-        tag_list.append(tag)
-        res_list.append(res)
+        stack.push(tag, res)
 
         return res
 
-    def clear_tag(self, match: Match, tag_list: List[str], res_list: List[str]) -> str:
-        pre_length = len(tag_list)
-        try:
-            self.sub_tag(match, tag_list, res_list)
+    def _resolve_new_tag(self, tag: str) -> Union[str, Callable[[], str], None]:
+        if self._user_codes is None:
+            self._flatten_user_tags()
+            res = self._tag_table.get(tag, _unresolved)
+            if res is not _unresolved:
+                return res
 
-            # If list did not change, the tag is unknown
-            if len(tag_list) == pre_length:
-                return match.group(0)
+        res = self._shared_table.get(tag, _unresolved)
+        if res is not _unresolved:
+            return res
 
-            # Otherwise, tag matched so remove it
-            else:
-                return ""
+        res = self.resolve_tag(tag)
+        # The user tags are never added to, since resolve_tag() already stores
+        # the built-in tags in the shared table.
+        table = self._tag_table
+        if table is not self._user_codes:
+            if len(table) >= self.tag_table_size:
+                table.clear()
+            table[tag] = res
+        return res
+
+    def resolve_tag(self, tag: str) -> Union[str, Callable[[], str], None]:
+        """Return the escape code for a tag name, a callable user tag or None if the tag is unknown."""
+        # User-defined tags take preference over all other.
+        if self._user_codes is None:
+            self._flatten_user_tags()
+        if tag in self._user_codes:
+            return self._user_codes[tag]
+        return builtin_tag(tag)
+
+    def clear_tag(self, match: Match, stack: "TagStack") -> str:
+        return self._clear(match.group(0), match.group(1), stack)
+
+    def _clear(self, markup: str, tag: str, stack: "TagStack") -> str:
+        # Known tags are removed, even if they are mismatched or unbalanced.
+        # Unknown tags are left as-is. The stack is not needed for that.
+        res = self._tag_table.get(tag, _unresolved)
+        if res is _unresolved:
+            res = self._resolve_new_tag(tag)
+        return markup if res is None else ""
+
+    def _clear_strict(self, markup: str, tag: str, stack: "TagStack") -> str:
+        # Same as _clear(), but keeps track of the open tags and raises the
+        # same errors as _sub() for closing tags that do not match them.
+        if markup[1] != "/":
+            if self._clear(markup, tag, stack):
+                return markup
+            stack.push(tag, "")
+            return ""
 
-        # Tag matched but is invalid, remove it anyway
-        except (UnbalancedTag, MismatchedTag):
+        tags = stack.tags
+        if tags and tags[-1] == tag:
+            stack.pop()
             return ""
+        if self._clear(markup, tag, stack):
+            return markup
+        if tag in stack.counts:
+            raise UnbalancedTag('closing tag "%s" violates nesting rules.' % markup)
+        raise MismatchedTag('closing tag "%s" has no corresponding opening tag' % markup)
+
+    def _strip_scan(self, text: str) -> str:
+        """Same as _render_scan() with _clear() inlined."""
+        opening, closing = self.tag_sep[0], self.tag_sep[1]
+        if opening not in text:
+            return text
+        if text.__class__ is not str:
+            text = str.__str__(text)
+
+        table, find = self._tag_table, text.find
+        out, pos = [], 0
+        start = find(opening)
+
+        while start != -1:
+            end = find(closing, start + 1)
+            if end == -1:
+                break
+
+            nested = find(opening, start + 1, end)
+            if nested != -1:
+                start = nested
+                continue
+
+            if text[start + 1] == "/":
+                tag = text[start + 2 : end] or "/"
+            else:
+                tag = text[start + 1 : end]
+                if not tag:
+                    start = find(opening, end)
+                    continue
+
+            res = table.get(tag, _unresolved)
+            if res is _unresolved:
+                res = self._resolve_new_tag(tag)
+            if res is not None:
+                out.append(text[pos:start])
+                pos = end + 1
+            start = find(opening, end + 1)
+
+        out.append(text[pos:])
+        return "".join(out)
+
+    _render, _strip = _render_scan, _strip_scan
+
+    def _strip_regex(self, text: str) -> str:
+        return self.re_tag.sub(lambda m: self._clear(m.group(0), m.group(1), None), text)
+
+    @cached_property
+    def re_tag(self) -> Pattern:
+        # Only the regex engine needs the regex - it is compiled on first use
+        # and shared with other instances.
+        key = (type(self).compile_tag_regex, tuple(self.tag_sep))
+        res = tag_grammars.get(key)
+        if res is None:
+            res = tag_grammars[key] = self.compile_tag_regex(self.tag_sep)
+        return res
 
     def compile_tag_regex(self, tag_sep) -> Pattern:
         # Optimize the default:
@@ -206,20 +900,382 @@ class AnsiMarkup:
             tag_regex = re.compile(r"</?([^<>]+)>")
             return tag_regex
 
-        if len(tag_sep) != 2:
-            raise ValueError('tag_sep needs to have exactly two elements (e.g. "<>")')
-
-        if tag_sep[0] == tag_sep[1]:
-            raise ValueError("opening and closing characters cannot be the same")
-
+        check_tag_sep(tag_sep)
         tag_regex = r"{0}/?([^{0}{1}]+){1}".format(tag_sep[0], tag_sep[1])
         return re.compile(tag_regex)
 
 
+# Built-in tags resolve to the same escape codes for every instance, so they
+# are resolved once and shared. Instances without user tags use this table
+# as their own.
+builtin_tag_table: Dict[str, Optional[str]] = {}
+
+# Compiled tag grammars, keyed by the function that compiles them and tag_sep.
+tag_grammars: Dict[Tuple[Callable, Tuple[str, ...]], Pattern] = {}
+
+
+def builtin_tag(tag: str) -> Optional[str]:
+    """Return the escape code for a built-in tag name or None if the tag is unknown."""
+    res = builtin_tag_table.get(tag, _unresolved)
+    if res is _unresolved:
+        res = resolve_builtin_tag(tag)
+        if len(builtin_tag_table) >= AnsiMarkup.tag_table_size:
+            builtin_tag_table.clear()
+        builtin_tag_table[tag] = res
+    return res
+
+
+def resolve_builtin_tag(tag: str) -> Optional[str]:
+    res = None
+
+    # Substitute on a direct match.
+    if tag in all_tags:
+        res = all_tags[tag]
+
+    # An alternative syntax for setting the color (e.g. <fg red>, <bg red>).
+    elif tag.startswith("fg ") or tag.startswith("bg "):
+        st, color = tag[:2], tag[3:]
+        code = "38" if st == "fg" else "48"
+
+        if st == "fg" and color in foreground:
+            res = foreground[color]
+        elif st == "bg" and color.islower() and color.upper() in background:
+            res = background[color.upper()]
+        elif color.isdigit() and int(color) <= 255:
+            res = "\033[%s;5;%sm" % (code, color)
+        elif re.match(r"#(?:[a-fA-F0-9]{3}){1,2}$", color):
+            hex_color = color[1:]
+            if len(hex_color) == 3:
+                r, g, b = hex_color
+                hex_color = r * 2 + g * 2 + b * 2
+            res = "\033[%s;2;%s;%s;%sm" % ((code,) + hex_to_rgb(hex_color))
+        elif color.count(",") == 2:
+            colors = tuple(color.split(","))
+            if all(x.isdigit() and int(x) <= 255 for x in colors):
+                res = "\033[%s;2;%s;%s;%sm" % ((code,) + colors)
+
+    # Shorthand formats (e.g. <red,blue>, <bold,red,blue>).
+    elif "," in tag:
+        el_count = tag.count(",")
+
+        if el_count == 1:
+            fg, bg = tag.split(",")
+            if fg in foreground and bg.islower() and bg.upper() in background:
+                res = foreground[fg] + background[bg.upper()]
+
+        elif el_count == 2:
+            st, fg, bg = tag.split(",")
+            if st in style and (fg != "" or bg != ""):
+                if fg == "" or fg in foreground:
+                    if bg == "" or (bg.islower() and bg.upper() in background):
+                        res = style[st] + foreground.get(fg, "") + background.get(bg.upper(), "")
+
+    return res
+
+
+def check_tag_sep(tag_sep: Sequence[str]):
+    if len(tag_sep) != 2:
+        raise ValueError('tag_sep needs to have exactly two elements (e.g. "<>")')
+
+    if tag_sep[0] == tag_sep[1]:
+        raise ValueError("opening and closing characters cannot be the same")
+
+
+_worker_ansimarkup: Optional[AnsiMarkup] = None
+
+
+def _init_worker(config: dict):
+    global _worker_ansimarkup
+    _worker_ansimarkup = AnsiMarkup(**config)
+
+
+def _parse_worker(chunk: List[str]) -> List[str]:
+    return _worker_ansimarkup._parse_chunk(chunk)
+
+
+class TagStack:
+    """
+    The currently open tags, along with their escape codes. Closing a tag
+    emits a reset followed by the codes of all enclosing tags, which restores
+    their style. Checking whether a tag is open is a constant-time operation.
+    """
+
+    __slots__ = ("tags", "codes", "counts")
+
+    def __init__(self):
+        self.tags: List[str] = []
+        self.codes: List[str] = []
+        self.counts: Dict[str, int] = {}
+
+    def push(self, tag: str, code: str):
+        self.tags.append(tag)
+        self.codes.append(code)
+        self.counts[tag] = self.counts.get(tag, 0) + 1
+
+    def pop(self) -> str:
+        """Close the innermost tag and return the escape sequence that restores the enclosing style."""
+        tag = self.tags.pop()
+        self.codes.pop()
+
+        count = self.counts[tag] - 1
+        if count:
+            self.counts[tag] = count
+        else:
+            del self.counts[tag]
+
+        # Only the codes of each depth are stored, which keeps the stack linear
+        # in size. The restore sequence is as long as the output it produces.
+        return Style.RESET_ALL + "".join(self.codes)
+
+    def copy(self) -> "TagStack":
+        stack = TagStack()
+        stack.tags, stack.codes, stack.counts = self.tags[:], self.codes[:], self.counts.copy()
+        return stack
+
+    def __eq__(self, other):
+        return self.tags == other.tags and self.codes == other.codes
+
+    def __len__(self):
+        return len(self.tags)
+
+
+class AnsiMarkupCachedTag:
+    """
+    A callable user tag whose result is reused until ``refresh_tags()`` is
+    called or, if ttl is given, for at most ttl seconds.
+    """
+
+    __slots__ = ("func", "ttl")
+
+    def __init__(self, func: Callable[[], str], ttl: Optional[float] = None):
+        self.func = func
+        self.ttl = ttl
+
+    def __call__(self) -> str:
+        return self.func()
+
+    def __repr__(self):
+        return "<%s %r ttl=%r>" % (self.__class__.__name__, self.func, self.ttl)
+
+
+class AnsiMarkupAlias(str):
+    """A user tag defined in markup (e.g. ``alias("<b><r>")``)."""
+
+
 class AnsiMarkupRawString(str):
     pass
 
 
+class CompiledMarkup:
+    """
+    Markup that has been split into text and escape code segments ahead of
+    time. The same compiled markup can be rendered to escape codes, to plain
+    text and to HTML. Example usage::
+
+      >>> am = AnsiMarkup()
+      >>> c = am.compile('<b>abc</b>')
+      >>> c.render() == am.parse('<b>abc</b>')
+      True
+      >>> c.strip()
+      'abc'
+      >>> c.html()
+      '<span style="font-weight: bold">abc</span>'
+
+    """
+
+    __slots__ = ("ansimarkup", "markup", "segments", "open_tags", "dynamic", "text", "generation")
+
+    def __init__(self, am: AnsiMarkup, markup: str, segments: List[str], open_tags: List[str], dynamic: bool):
+        self.ansimarkup = am
+        self.markup = markup
+        self.segments = tuple(segments)
+        self.open_tags = tuple(open_tags)
+        self.dynamic = dynamic
+        self.text = SgrRenderer().render(segments) if am.minimal else "".join(segments)
+        self.generation = am._generation
+
+    def update(self) -> bool:
+        """
+        Recompile the markup if the user tags have changed or cached user tags
+        have been refreshed since it was compiled. Returns True if it was.
+        """
+        am = self.ansimarkup
+        am._check_tags()
+        if self.generation == am._generation:
+            return False
+
+        compiled = am.compile(self.markup)
+        for name in self.__slots__:
+            setattr(self, name, getattr(compiled, name))
+        return True
+
+    def render(self, aslist: bool = False) -> str:
+        """Return the same result as ``parse()`` would for the compiled markup."""
+        am = self.ansimarkup
+        if self.dynamic:
+            return am._parse((self.markup,), aslist)
+        self.update()
+        return am._finish([self.text], list(self.open_tags), aslist)
+
+    __call__ = render
+
+    def strip(self) -> str:
+        """Return the text of the compiled markup without escape codes."""
+        self.update()
+        return "".join(self.segments[::2])
+
+    def spans(self) -> List[Tuple[str, Optional[sgr.SgrState]]]:
+        """
+        Return the runs of text along with the display attributes they are
+        rendered with (see ``sgr.SgrState``). The attributes of text that
+        follows escape codes other than SGR sequences are None.
+        """
+        segments = self.segments
+        if self.dynamic:
+            segments = self.ansimarkup.compile(self.markup).segments
+        elif self.update():
+            segments = self.segments
+        return sgr.spans(segments)
+
+    def html(self) -> str:
+        """Return the compiled markup as HTML, with styled text in ``<span>`` elements."""
+        from html import escape
+
+        res = []
+        for text, state in self.spans():
+            style = sgr.css(state) if state else ""
+            if style:
+                res.append('<span style="%s">%s</span>' % (style, escape(text)))
+            else:
+                res.append(escape(text))
+        return "".join(res)
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self.markup)
+
+
+class MarkupTemplate:
+    """
+    Markup with ``str.format()`` placeholders that has been compiled ahead of
+    time. Rendering only substitutes the placeholders. Example usage::
+
+      >>> am = AnsiMarkup()
+      >>> t = am.template('<r>{user}</r>: {0:>5}')
+      >>> t.render(42, user='<admin>') == am.parse('<r>') + '<admin>' + am.parse('</r>') + ':    42'
+      True
+
+    """
+
+    __slots__ = ("compiled", "fmt", "open_tags")
+
+    def __init__(self, am: AnsiMarkup, markup: str):
+        opening, closing = am.tag_sep
+        if "{" in (opening, closing) or "}" in (opening, closing):
+            raise ValueError("templates cannot be used with curly brace tag separators")
+
+        self.compiled = am.compile(markup)
+        self.fmt, self.open_tags = self._compile(self.compiled)
+
+        # Fail early on malformed placeholders.
+        from string import Formatter
+
+        list(Formatter().parse(self.fmt))
+
+    @staticmethod
+    def _compile(compiled: CompiledMarkup) -> Tuple[str, List[str]]:
+        # Escape codes are literal text in the format string.
+        segments = list(compiled.segments)
+        for i in range(1, len(segments), 2):
+            segments[i] = segments[i].replace("{", "{{").replace("}", "}}")
+
+        fmt = SgrRenderer().render(segments) if compiled.ansimarkup.minimal else "".join(segments)
+        return fmt, list(compiled.open_tags)
+
+    def render(self, *args, **kwargs) -> str:
+        """Substitute the placeholders, as ``str.format()`` would."""
+        compiled = self.compiled
+        if compiled.dynamic:
+            fmt, open_tags = self._compile(compiled.ansimarkup.compile(compiled.markup))
+        else:
+            if compiled.update():
+                self.fmt, self.open_tags = self._compile(compiled)
+            fmt, open_tags = self.fmt, self.open_tags
+        return compiled.ansimarkup._finish([fmt.format(*args, **kwargs)], open_tags, False)
+
+    __call__ = render
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self.compiled.markup)
+
+
+class AnsiMarkupStream:
+    """
+    Incremental parser for markup that arrives in chunks. Example usage::
+
+      >>> stream = AnsiMarkup().stream()
+      >>> stream.feed('<b>ab')   # '\x1b[1mab'
+      >>> stream.feed('c</')     # 'c'
+      >>> stream.feed('b>')      # '\x1b[0m'
+      >>> stream.close()         # ''
+
+    A tag that is split between chunks is held back until it is complete or
+    until it grows longer than max_tag_length, in which case it is passed
+    through as text.
+    """
+
+    def __init__(self, am: AnsiMarkup, max_tag_length: int = 256, strip: bool = False):
+        self.ansimarkup = am
+        self.max_tag_length = max_tag_length
+        self.strip = strip
+        self.stack = TagStack()
+        self.pending = ""
+        self.sgr = SgrRenderer() if am.minimal and not strip else None
+
+    def feed(self, chunk: str) -> str:
+        """Parse a chunk of markup and return as much of the output as is available."""
+        self.ansimarkup._check_tags()
+        if isinstance(chunk, self.ansimarkup.rawstring_cls):
+            text, self.pending = self.pending, ""
+            return self._render(text) + chunk
+
+        text = self.pending + chunk if self.pending else chunk
+        self.pending = ""
+
+        # Hold back a trailing tag that may be completed by the next chunk.
+        opening, closing = self.ansimarkup.tag_sep[0], self.ansimarkup.tag_sep[1]
+        start = text.rfind(opening)
+        if start != -1 and text.find(closing, start) == -1 and len(text) - start <= self.max_tag_length:
+            text, self.pending = text[:start], text[start:]
+
+        return self._render(text)
+
+    def close(self) -> str:
+        """Return the remaining output and apply the strict and always_reset options."""
+        text, self.pending = self._render(self.pending, flush=True), ""
+        if self.strip:
+            self.ansimarkup._check_closed(self.stack.tags)
+            return text
+        return self.ansimarkup._finish([text], self.stack.tags, aslist=False)
+
+    @property
+    def sub(self) -> SubType:
+        # Looked up for every chunk, so that the tags of a stream created
+        # before instrument() are counted too.
+        am = self.ansimarkup
+        if self.strip:
+            return am._clear_strict if am.strict else am._clear
+        return am._sub
+
+    def _render(self, text: str, flush: bool = False) -> str:
+        parts = []
+        if text:
+            self.ansimarkup._render(text, self.sub, self.stack, parts)
+        if self.sgr:
+            # Style changes are deferred until the text they apply to arrives.
+            return self.sgr.render(parts or [""], flush)
+        return "".join(parts)
+
+
 class AnsiMarkupString(str):
     """
     A string containing the original markup, the formatted string and the
@@ -241,26 +1297,203 @@ class AnsiMarkupString(str):
       >>> t.delta
       8
 
+    Slicing, padding, truncating and wrapping work on the visible characters
+    and return new strings that keep the styles of the characters they contain::
+
+      >>> t = AnsiMarkup().ansistring('<b>abc</b>def')
+      >>> t[1:4] == AnsiMarkup().parse('<b>bc</b>d')
+      True
+      >>> len(t.ljust(10)), len(t.truncate(4)), t.truncate(4).stripped
+      (10, 4, 'abc…')
+
     """
 
     def __new__(cls, am, markup):
-        parsed = am.parse(markup)
+        # The markup is tokenized once. The segments at even positions are the
+        # text between tags, which is all that is needed to get the length.
+        compiled = am.compile(markup)
+        parsed = am._finish([compiled.text], list(compiled.open_tags), aslist=False)
 
         new_str = str.__new__(cls, parsed)
         new_str.markup = markup
-        new_str.stripped = am.strip(markup)
+        new_str._ansimarkup = am
+        new_str._length = sum(map(len, compiled.segments[::2]))
 
-        # The difference in length between the formatted string and the string
-        # with markup tags stripped off.
-        new_str.delta: int = len(parsed) - len(new_str.stripped)
+        # Callable user tags may return something else when compiled again.
+        if compiled.dynamic:
+            new_str._segments = new_str._split(compiled)
+        return new_str
 
+    @classmethod
+    def _from_segments(cls, am, segments: List[str]) -> "AnsiMarkupString":
+        new_str = str.__new__(cls, "".join(segments))
+        new_str.markup = None
+        new_str._ansimarkup = am
+        new_str._segments = segments
+        new_str._length = sum(map(len, segments[::2]))
         return new_str
 
+    @cached_property
+    def _segments(self) -> List[str]:
+        """
+        The runs of text and escape codes of the string. They are only needed
+        for slicing and layout, so the markup is compiled again on first use
+        rather than kept around by every string.
+        """
+        return self._split(self._ansimarkup.compile(self.markup))
+
+    def _split(self, compiled: "CompiledMarkup") -> List[str]:
+        am, text = self._ansimarkup, str.__str__(self)
+        if not text.startswith(compiled.text):
+            # The user tags have changed since the string was created.
+            return re.split(r"(\x1b\[[0-9;]*m)", text)
+
+        segments = sgr.minimize(compiled.segments) if am.minimal else list(compiled.segments)
+        if len(text) > len(compiled.text):
+            segments += [text[len(compiled.text) :], ""]
+        return segments
+
+    @cached_property
+    def stripped(self) -> str:
+        return "".join(self._segments[::2])
+
+    @cached_property
+    def _index(self) -> Tuple[List[int], List[int], List[str]]:
+        """
+        The visible offset at which each run of text starts, the position of
+        the run in the segments and the escape codes that re-open its style.
+        """
+        offsets, positions, styles = [], [], []
+        state, codes, visible = sgr.DEFAULT, [], 0
+
+        for i, segment in enumerate(self._segments):
+            if i % 2:
+                state = sgr.apply(state, segment)
+                codes.append(segment)
+            elif segment:
+                offsets.append(visible)
+                positions.append(i)
+                # Escape codes other than SGR sequences are replayed as they are.
+                styles.append("".join(codes) if state is None else sgr.transition(sgr.DEFAULT, state))
+                visible += len(segment)
+
+        return offsets, positions, styles
+
+    @property
+    def delta(self) -> int:
+        """The difference in length between the formatted string and the string with markup tags stripped off."""
+        return str.__len__(self) - self._length
+
     def __len__(self):
-        return len(self.stripped)
+        return self._length
 
     def __repr__(self):
-        return self.markup
+        return str.__repr__(self) if self.markup is None else self.markup
+
+    def __getitem__(self, key: Union[int, slice]) -> "AnsiMarkupString":
+        """Return the visible characters in key, in the styles they are displayed in."""
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._length)
+            if step != 1:
+                raise ValueError("%s slices do not support steps" % type(self).__name__)
+            return self._slice(start, stop)
+
+        index = key + self._length if key < 0 else key
+        if not 0 <= index < self._length:
+            raise IndexError("string index out of range")
+        return self._slice(index, index + 1)
+
+    def _slice(self, start: int, stop: int) -> "AnsiMarkupString":
+        if start >= stop:
+            return self._from_segments(self._ansimarkup, [""])
+        if start == 0 and stop == self._length and str.rfind(self, "\x1b[") == str.rfind(self, Style.RESET_ALL):
+            # The whole string, whose last escape code (if any) is a reset.
+            return self
+
+        offsets, positions, styles = self._index
+        segments = self._segments
+        first = bisect_right(offsets, start) - 1
+        last = bisect_left(offsets, stop) - 1
+
+        text = segments[positions[first]]
+        if first == last:
+            res = ["", styles[first], text[start - offsets[first] : stop - offsets[first]]]
+        else:
+            res = ["", styles[first], text[start - offsets[first] :]]
+            res.extend(segments[positions[first] + 1 : positions[last]])
+            res.append(segments[positions[last]][: stop - offsets[last]])
+
+        if styles[last]:
+            res += [Style.RESET_ALL, ""]
+        return self._from_segments(self._ansimarkup, res)
+
+    def _pad(self, left: int, right: int, fillchar: str) -> "AnsiMarkupString":
+        if len(fillchar) != 1:
+            raise TypeError("The fill character must be exactly one character long")
+        if left <= 0 and right <= 0:
+            return self
+        segments = list(self._segments)
+        segments[0] = fillchar * left + segments[0]
+        segments[-1] = segments[-1] + fillchar * right
+        return self._from_segments(self._ansimarkup, segments)
+
+    def ljust(self, width: int, fillchar: str = " ") -> "AnsiMarkupString":
+        """Pad the string on the right to a visible width of width."""
+        return self._pad(0, width - self._length, fillchar)
+
+    def rjust(self, width: int, fillchar: str = " ") -> "AnsiMarkupString":
+        """Pad the string on the left to a visible width of width."""
+        return self._pad(width - self._length, 0, fillchar)
+
+    def center(self, width: int, fillchar: str = " ") -> "AnsiMarkupString":
+        """Center the string in a visible width of width, like ``str.center()``."""
+        margin = width - self._length
+        left = margin // 2 + (margin & width & 1)
+        return self._pad(left, margin - left, fillchar)
+
+    def truncate(self, width: int, placeholder: str = "…") -> "AnsiMarkupString":
+        """Shorten the string to a visible width of width, ending it with placeholder if it was shortened."""
+        if self._length <= width:
+            return self
+        res = self._slice(0, max(width - len(placeholder), 0))
+        return self._from_segments(self._ansimarkup, res._segments + ["", placeholder[:width]])
+
+    def wrap(
+        self,
+        width: int = 70,
+        initial_indent: str = "",
+        subsequent_indent: str = "",
+        break_long_words: bool = True,
+        break_on_hyphens: bool = True,
+        drop_whitespace: bool = True,
+    ) -> List["AnsiMarkupString"]:
+        """
+        Wrap the string into lines of at most width visible characters, like
+        ``textwrap.wrap()``. Each line re-opens the styles it starts in and is
+        reset at its end. Tabs and other whitespace are kept as they are.
+        """
+        from textwrap import TextWrapper
+
+        wrapper = TextWrapper(
+            width,
+            initial_indent=initial_indent,
+            subsequent_indent=subsequent_indent,
+            expand_tabs=False,
+            replace_whitespace=False,
+            break_long_words=break_long_words,
+            break_on_hyphens=break_on_hyphens,
+            drop_whitespace=drop_whitespace,
+        )
+
+        # Each line is a run of the stripped text that follows the previous one.
+        res, stripped, pos = [], self.stripped, 0
+        for i, line in enumerate(wrapper.wrap(stripped)):
+            indent = subsequent_indent if i else initial_indent
+            line = line[len(indent) :]
+            pos = stripped.find(line, pos)
+            line, pos = self._slice(pos, pos + len(line)), pos + len(line)
+            res.append(self._from_segments(self._ansimarkup, [indent, ""] + line._segments) if indent else line)
+        return res
 
 
 def hex_to_rgb(value: str) -> Tuple[int, int, int]:
@@ -0,0 +1,298 @@
+"""
+Track the terminal state that SGR (Select Graphic Rendition) escape
+sequences produce and compute the shortest sequence between two states.
+"""
+
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
+
+
+class SgrState(NamedTuple):
+    bold: bool = False
+    dim: bool = False
+    italic: bool = False
+    underline: bool = False
+    blink: bool = False
+    reverse: bool = False
+    hide: bool = False
+    strike: bool = False
+    fg: Optional[str] = None
+    bg: Optional[str] = None
+
+
+DEFAULT = SgrState()
+
+# Flag attributes with the parameters that turn them on and off. Bold and dim
+# are both turned off by 22 and are handled separately.
+flags = {
+    "italic": ("3", "23"),
+    "underline": ("4", "24"),
+    "blink": ("5", "25"),
+    "reverse": ("7", "27"),
+    "hide": ("8", "28"),
+    "strike": ("9", "29"),
+}
+flag_params = {on: (name, True) for name, (on, off) in flags.items()}
+flag_params.update({off: (name, False) for name, (on, off) in flags.items()})
+
+fg_params = {str(i) for i in (*range(30, 38), *range(90, 98))}
+bg_params = {str(i) for i in (*range(40, 48), *range(100, 108))}
+
+re_sgr = re.compile(r"\x1b\[([0-9;]*)m")
+
+
+def split_sgr(code: str) -> Optional[List[str]]:
+    """Return the parameters of a string of SGR sequences or None if it contains anything else."""
+    params, pos = [], 0
+    for match in re_sgr.finditer(code):
+        if match.start() != pos:
+            return None
+        params.extend(match.group(1).split(";"))
+        pos = match.end()
+    return params if pos == len(code) else None
+
+
+@lru_cache(maxsize=4096)
+def apply(state: Optional[SgrState], code: str) -> Optional[SgrState]:
+    """
+    Return the state after the SGR sequences in code are applied to state. An
+    unknown state (None) only becomes known again after a reset. Returns None
+    if the result cannot be determined.
+    """
+    params = split_sgr(code)
+    if params is None or (state is None and params[:1] not in (["0"], [""])):
+        return None
+
+    attrs = (state or DEFAULT)._asdict()
+    i = 0
+    while i < len(params):
+        param = params[i]
+        if param in ("0", ""):
+            attrs = DEFAULT._asdict()
+        elif param == "1":
+            attrs["bold"] = True
+        elif param == "2":
+            attrs["dim"] = True
+        elif param == "22":
+            attrs["bold"] = attrs["dim"] = False
+        elif param in flag_params:
+            name, value = flag_params[param]
+            attrs[name] = value
+        elif param in fg_params:
+            attrs["fg"] = param
+        elif param in bg_params:
+            attrs["bg"] = param
+        elif param == "39":
+            attrs["fg"] = None
+        elif param == "49":
+            attrs["bg"] = None
+        elif param in ("38", "48"):
+            size = {"5": 3, "2": 5}.get(params[i + 1] if i + 1 < len(params) else None)
+            if size is None or i + size > len(params):
+                return None
+            attrs["fg" if param == "38" else "bg"] = ";".join(params[i : i + size])
+            i += size - 1
+        else:
+            return None
+        i += 1
+
+    return SgrState(**attrs)
+
+
+def absolute_params(state: SgrState) -> List[str]:
+    """Return the parameters that produce state from the default state."""
+    params = []
+    if state.bold:
+        params.append("1")
+    if state.dim:
+        params.append("2")
+    for name, (on, off) in flags.items():
+        if getattr(state, name):
+            params.append(on)
+    if state.fg:
+        params.append(state.fg)
+    if state.bg:
+        params.append(state.bg)
+    return params
+
+
+@lru_cache(maxsize=4096)
+def transition(old: Optional[SgrState], new: SgrState) -> str:
+    """Return the shortest SGR sequence that changes the terminal from the old to the new state."""
+    if old == new:
+        return ""
+
+    reset = ["0"] + absolute_params(new)
+    if old is None:
+        return "\033[%sm" % ";".join(reset)
+
+    params = []
+    if (old.bold and not new.bold) or (old.dim and not new.dim):
+        params.append("22")
+        params.extend(absolute_params(SgrState(bold=new.bold, dim=new.dim)))
+    else:
+        if new.bold and not old.bold:
+            params.append("1")
+        if new.dim and not old.dim:
+            params.append("2")
+
+    for name, (on, off) in flags.items():
+        value = getattr(new, name)
+        if value != getattr(old, name):
+            params.append(on if value else off)
+
+    if new.fg != old.fg:
+        params.append(new.fg or "39")
+    if new.bg != old.bg:
+        params.append(new.bg or "49")
+
+    params = min(reset, params, key=lambda i: len(";".join(i)))
+    return "\033[%sm" % ";".join(params)
+
+
+class SgrRenderer:
+    """
+    Join alternating runs of text and escape codes, while only emitting the
+    attributes that changed between runs of text. Consecutive escape codes
+    are merged into a single SGR sequence. Escape codes that are not SGR
+    sequences are emitted as-is.
+    """
+
+    def __init__(self):
+        self.emitted: Optional[SgrState] = DEFAULT
+        self.pending: Optional[SgrState] = DEFAULT
+
+    def render(self, segments: List[str], flush: bool = True) -> str:
+        """
+        Render segments, starting from the state the previous call left off.
+        If flush is false, trailing escape codes are deferred to the next call.
+        """
+        return "".join(self.render_parts(segments, flush))
+
+    def render_parts(self, segments: list, flush: bool = True) -> list:
+        """
+        Same as render(), but return the parts of the output without joining
+        them. The runs of text may be of any sized type (e.g. bytes).
+        """
+        out = []
+        emitted, pending = self.emitted, self.pending
+
+        for i, segment in enumerate(segments):
+            if i % 2 == 0:
+                if segment:
+                    if pending != emitted:
+                        out.append(transition(emitted, pending))
+                        emitted = pending
+                    out.append(segment)
+                continue
+
+            new = apply(pending, segment)
+            if new is None:
+                if pending != emitted and pending is not None:
+                    out.append(transition(emitted, pending))
+                out.append(segment)
+                emitted = pending = apply(None, segment)
+            else:
+                pending = new
+
+        if flush and pending != emitted:
+            out.append(transition(emitted, pending))
+            emitted = pending
+
+        self.emitted, self.pending = emitted, pending
+        return out
+
+
+def minimize(segments: List[str]) -> List[str]:
+    """
+    Return alternating runs of text and escape codes that join to the same
+    string as ``SgrRenderer().render(segments)``.
+    """
+    renderer, res, pending = SgrRenderer(), [""], [""]
+    for i, segment in enumerate(segments):
+        if i % 2:
+            pending += [segment, ""]
+        elif segment or i == len(segments) - 1:
+            pending[-1] = segment
+            parts = renderer.render_parts(pending)
+            if segment:
+                res += ["".join(parts[:-1]), segment]
+            elif parts:
+                res += ["".join(parts), ""]
+            pending = [""]
+    return res
+
+
+# The default palette of xterm for the 16 basic colors.
+palette = (
+    "#000000", "#cd0000", "#00cd00", "#cdcd00", "#0000ee", "#cd00cd", "#00cdcd", "#e5e5e5",
+    "#7f7f7f", "#ff0000", "#00ff00", "#ffff00", "#5c5cff", "#ff00ff", "#00ffff", "#ffffff",
+)  # fmt: skip
+
+
+def css_color(param: str) -> str:
+    """Return the CSS color of a foreground or background color parameter (e.g. '31', '38;5;200')."""
+    params = param.split(";")
+    if len(params) == 5:
+        return "#%02x%02x%02x" % tuple(int(i) for i in params[2:])
+
+    if len(params) == 3:
+        index = int(params[2])
+        if index < 16:
+            return palette[index]
+        if index < 232:
+            index -= 16
+            rgb = (index // 36, index // 6 % 6, index % 6)
+            return "#%02x%02x%02x" % tuple(i * 40 + 55 if i else 0 for i in rgb)
+        return "#%02x%02x%02x" % (((index - 232) * 10 + 8,) * 3)
+
+    code = int(param)
+    return palette[code % 10 + (8 if code >= 90 else 0)]
+
+
+@lru_cache(maxsize=1024)
+def css(state: SgrState) -> str:
+    """Return the inline CSS that renders the attributes of state."""
+    rules = []
+    fg = css_color(state.fg) if state.fg else None
+    bg = css_color(state.bg) if state.bg else None
+    if state.reverse:
+        fg, bg = bg or "canvas", fg or "canvastext"
+
+    if fg:
+        rules.append("color: %s" % fg)
+    if bg:
+        rules.append("background-color: %s" % bg)
+    if state.bold:
+        rules.append("font-weight: bold")
+    if state.dim:
+        rules.append("opacity: 0.5")
+    if state.italic:
+        rules.append("font-style: italic")
+
+    decorations = (("underline", state.underline), ("line-through", state.strike), ("blink", state.blink))
+    decorations = [name for name, on in decorations if on]
+    if decorations:
+        rules.append("text-decoration: %s" % " ".join(decorations))
+    if state.hide:
+        rules.append("visibility: hidden")
+    return "; ".join(rules)
+
+
+def spans(segments: List[str]) -> List[Tuple[str, Optional[SgrState]]]:
+    """
+    Return the runs of text in alternating text and escape code segments
+    along with the state they are displayed in. The state of text that follows
+    escape codes other than SGR sequences is None.
+    """
+    res, state = [], DEFAULT
+    for i, segment in enumerate(segments):
+        if i % 2:
+            state = apply(state, segment)
+        elif segment:
+            if res and res[-1][1] == state:
+                res[-1] = (res[-1][0] + segment, state)
+            else:
+                res.append((segment, state))
+    return res
@@ -1,3 +1,5 @@
+import io
+
 from pytest import fixture
 from ansimarkup import AnsiMarkup
 
@@ -5,3 +7,13 @@ from ansimarkup import AnsiMarkup
 @fixture()
 def am():
     return AnsiMarkup()
+
+
+class TtyStream(io.StringIO):
+    def isatty(self):
+        return True
+
+
+@fixture()
+def tty():
+    return TtyStream()
@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the internals of ansimarkup. Unlike benchmark.py, this script
+does not depend on any third-party libraries.
+
+Usage: python tests/perf.py [<benchmark> ...]
+       python tests/perf.py suite [--full] [--json <path>] [--update-baseline] [<case> ...]
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import re
+import sys
+import tracemalloc
+from timeit import Timer
+
+from ansimarkup import AnsiMarkup, AnsiMarkupError, MismatchedTag
+from ansimarkup.ansi import Style
+from ansimarkup.logformatter import AnsiMarkupFormatter
+from ansimarkup.markup import AnsiMarkupRawString, AnsiMarkupString, TagStack, resolve_builtin_tag
+
+
+benchmarks = {}
+
+
+def benchmark(func):
+    benchmarks[func.__name__] = func
+    return func
+
+
+def timeit(func, n=1, r=3):
+    """Return the best time of r runs of func in seconds."""
+    return min(Timer(func).repeat(r, n)) / n
+
+
+def nested_markup(depth, reopen=0):
+    tags = ["b", "r", "u", "Y", "i", "fg 200"]
+    opening = ["<%s>" % tags[i % len(tags)] for i in range(depth)]
+    closing = ["</%s>" % tags[i % len(tags)] for i in reversed(range(depth))]
+    return "".join(opening) + "<d>x</d>" * reopen + "".join(closing)
+
+
+@benchmark
+def nesting():
+    am = AnsiMarkup()
+
+    # Every closing tag restores the style of all enclosing tags, so the size of
+    # the output grows with the square of the nesting depth. The time per tag
+    # and per output byte should stay flat.
+    def run(title, reopen):
+        print(title)
+        for depth in 10, 100, 1000, 10000:
+            markup = nested_markup(depth, reopen)
+            usec = timeit(lambda: am.parse(markup)) * 1e6
+            ntags, nbytes = depth * 2 + reopen * 2, len(am.parse(markup))
+            print(
+                "  depth {:<6} {:12.1f} μs {:8.3f} μs/tag {:8.3f} ns/byte".format(
+                    depth, usec, usec / ntags, usec * 1e3 / nbytes
+                )
+            )
+        print()
+
+    run("Nesting: <b><r>...x...</r></b>", 0)
+    run("Re-opened nesting: <b><r>...<d>x</d><d>x</d>...</r></b> (1000 re-opened tags)", 1000)
+
+    # Tags that are never closed only cost memory for the stack.
+    print("Unclosed nesting: <fg 200><fg 200>...x")
+    for depth in 1000, 10000, 100000:
+        markup = "<fg 200>" * depth + "x"
+        usec = timeit(lambda: am.parse(markup), r=1) * 1e6
+        tracemalloc.start()
+        am.parse(markup)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("  depth {:<6} {:12.1f} μs {:8.3f} μs/tag {:8.1f} MB peak".format(depth, usec, usec / depth, peak / 1e6))
+    print()
+
+
+def legacy_strip(am, text):
+    """strip() before it had a dedicated fast path - every tag goes through the parser."""
+    stack = TagStack()
+
+    def clear(match):
+        depth = len(stack)
+        try:
+            am._sub(match.group(0), match.group(1), stack)
+        except AnsiMarkupError:
+            return ""
+        return match.group(0) if len(stack) == depth else ""
+
+    return am.re_tag.sub(clear, text)
+
+
+@benchmark
+def strip():
+    am = AnsiMarkup()
+    docs = {
+        "tags": "<r><b>red bold</b>red</r><b>bold</b>",
+        "log line": "<g>2024-01-01 10:00:00</g> <b>INFO</b> request <fg #ff8800>/api/v1</fg #ff8800> 200 OK",
+        "mismatched": "<r>1</b>2<tag>3</tag></r></r>" * 10,
+        "no tags": "2024-01-01 10:00:00 INFO request /api/v1 200 OK",
+    }
+
+    print("strip")
+    for name, text in docs.items():
+        assert am.strip(text) == legacy_strip(am, text)
+        new = timeit(lambda: am.strip(text), n=10000) * 1e6
+        old = timeit(lambda: legacy_strip(am, text), n=10000) * 1e6
+        print("  {:<12} {:8.3f} μs (before: {:8.3f} μs)".format(name, new, old))
+    print()
+
+
+@benchmark
+def parse_many():
+    am = AnsiMarkup()
+    rows = [
+        "<b>{0:>6}</b> <g>{1}</g> <fg #ff8800>{2}</fg #ff8800> <d>{3}</d> {4}".format(i, i * 7, i % 13, i % 5, "x" * 50)
+        for i in range(200000)
+    ]
+
+    print("parse_many: {} rows".format(len(rows)))
+    usec = timeit(lambda: [am.parse(i) for i in rows], r=1) * 1e6
+    print("  {:<24} {:12.0f} μs".format("list comprehension", usec))
+
+    for executor in "thread", "process":
+        for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+            usec = timeit(lambda: am.parse_many(rows, workers, executor), r=1) * 1e6
+            print("  {:<24} {:12.0f} μs".format("%s x %d" % (executor, workers), usec))
+    print()
+
+
+@benchmark
+def ansistring():
+    am = AnsiMarkup()
+    rows = [
+        "<b>{0:>6}</b> <g>name-{0}</g> <fg #ff8800>{1}</fg #ff8800> padding".format(i, i % 13) for i in range(100000)
+    ]
+
+    print("ansistring: {} rows".format(len(rows)))
+    usec = timeit(lambda: [am.ansistring(i) for i in rows], r=1) * 1e6
+    print("  {:<24} {:12.3f} μs/row".format("create", usec / len(rows)))
+
+    tracemalloc.start()
+    strings = [am.ansistring(i) for i in rows]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("  {:<24} {:12.1f} bytes/row".format("memory", size / len(strings)))
+
+    usec = timeit(lambda: [len(i) + i.delta for i in strings], r=1) * 1e6
+    print("  {:<24} {:12.3f} μs/row".format("len() and delta", usec / len(rows)))
+    print()
+
+
+@benchmark
+def template():
+    am = AnsiMarkup()
+    fmt = "<g>{0}</g> <b>{1:<8}</b> <fg #ff8800>{path}</fg #ff8800> {2}"
+    t = am.template(fmt)
+    assert t("now", "INFO", "OK", path="/api") == am.parse(fmt.format("now", "INFO", "OK", path="/api"))
+
+    print("template")
+    new = timeit(lambda: t("now", "INFO", "OK", path="/api"), n=10000) * 1e6
+    old = timeit(lambda: am.parse(fmt.format("now", "INFO", "OK", path="/api")), n=10000) * 1e6
+    print("  {:<24} {:8.3f} μs (parse(fmt.format()): {:8.3f} μs)".format("render", new, old))
+    print()
+
+
+class LegacyFormatter(AnsiMarkupFormatter):
+    """AnsiMarkupFormatter before it compiled the format string - every record is parsed as a whole."""
+
+    def format(self, record):
+        return self.ansimarkup.parse(logging.Formatter.format(self, record))
+
+
+@benchmark
+def formatter():
+    am = AnsiMarkup()
+    fmt = "<g>%(asctime)s</g> <b>%(levelname)-8s</b> <d>%(name)s</d>: %(message)s"
+    messages = ["request <fg #ff8800>/api/v1/%d</fg #ff8800> <g>200 OK</g>" % i for i in range(1000)]
+    records = [logging.LogRecord("app.http", logging.INFO, __file__, 1, i, None, None) for i in messages]
+    plain = [logging.LogRecord("app.http", logging.INFO, __file__, 1, am.strip(i), None, None) for i in messages]
+
+    print("formatter: {} records".format(len(records)))
+    for name, cls in ("compiled", AnsiMarkupFormatter), ("before", LegacyFormatter):
+        for kind, rows in ("markup", records), ("no markup", plain):
+            instance = cls(fmt)
+            sec = timeit(lambda: [instance.format(i) for i in rows])
+            print("  {:<24} {:12.0f} records/s".format("%s, %s" % (name, kind), len(rows) / sec))
+    print()
+
+
+@benchmark
+def iterparse():
+    am = AnsiMarkup()
+    text = document(20 << 20)
+
+    print("iterparse: {:.0f} MB".format(len(text) / 1e6))
+    with open(os.devnull, "w") as fh:
+        for name, func in (
+            ("parse", lambda: fh.write(am.parse(text))),
+            ("iterparse", lambda: fh.writelines(am.iterparse(text))),
+        ):
+            usec = timeit(func, r=1) * 1e6
+            tracemalloc.start()
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("  {:<24} {:12.1f} MB/s {:10.1f} MB peak".format(name, len(text) / usec, peak / 1e6))
+    print()
+
+
+class BaselineMarkup:
+    """
+    AnsiMarkup before any of the optimizations, reduced to its constructor and
+    parse(). The user tags are kept as given, the tag regex is compiled by
+    every instance and tags are resolved on every use.
+    """
+
+    def __init__(
+        self, tags=None, always_reset=False, strict=False, tag_sep="<>", ansistring_cls=None, rawstring_cls=None
+    ):
+        self.user_tags = tags if tags else {}
+        self.always_reset = always_reset
+        self.strict = strict
+        self.tag_sep = tag_sep
+        self.ansistring_cls = ansistring_cls if ansistring_cls else AnsiMarkupString
+        self.rawstring_cls = self.raw = rawstring_cls if rawstring_cls else AnsiMarkupRawString
+        self.re_tag = re.compile(r"</?([^<>]+)>")
+
+    def parse(self, text):
+        tags, codes = [], []
+
+        def sub(match):
+            markup, tag = match.group(0), match.group(1)
+            if markup[1] == "/" and tags and tags[-1] == tag:
+                tags.pop()
+                codes.pop()
+                return Style.RESET_ALL + "".join(codes)
+
+            if tag in self.user_tags:
+                res = self.user_tags[tag]
+                res = res() if callable(res) else res
+            else:
+                res = resolve_builtin_tag(tag)
+            if res is None:
+                return markup
+            if markup[1] == "/":
+                raise MismatchedTag('closing tag "%s" has no corresponding opening tag' % markup)
+
+            tags.append(tag)
+            codes.append(res)
+            return res
+
+        return self.re_tag.sub(sub, text)
+
+
+@benchmark
+def construct():
+    tags = {"info": "\033[32m", "warn": "\033[33m"}
+    markup = "<b>x</b> <info>y</info> <fg #ff8800>z</fg #ff8800> <r,y>w</r,y>"
+    n = 10000
+
+    print("construct: {} instances".format(n))
+    for name, cls in ("current", AnsiMarkup), ("baseline", BaselineMarkup):
+        for kind, kwargs in ("no tags", {}), ("user tags", {"tags": tags}):
+            usec = timeit(lambda: [cls(**kwargs) for _ in range(n)]) * 1e6
+            print("  {:<24} {:12.3f} μs/instance".format("%s, %s" % (name, kind), usec / n))
+            usec = timeit(lambda: [cls(**kwargs).parse(markup) for _ in range(n)]) * 1e6
+            print("  {:<24} {:12.3f} μs/instance".format("  with one parse()", usec / n))
+
+            tracemalloc.start()
+            instances = [cls(**kwargs) for _ in range(1000)]
+            for am in instances:
+                am.parse(markup)
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print("  {:<24} {:12.0f} bytes/instance".format("  memory", size / len(instances)))
+    print()
+
+
+# The regression suite. Every case is timed along with a pure-Python
+# calibration workload, and is recorded relative to it, which makes the
+# results comparable between machines of different speeds.
+
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perf-baseline.json")
+
+log_line = "<g>2024-01-01 10:00:00</g> <b>INFO</b> request <fg #ff8800>/api/v1</fg #ff8800> <d>200 OK</d>\n"
+
+syntaxes = {
+    "named": "<b>x</b><red>x</red><bg blue>x</bg blue>",
+    "shorthand": "<b,r,y>x</b,r,y><r,y>x</r,y>",
+    "fg hex": "<fg #ff8800>x</fg #ff8800><bg #f80>x</bg #f80>",
+    "fg rgb": "<fg 255,136,0>x</fg 255,136,0><bg 1,2,3>x</bg 1,2,3>",
+    "fg xterm": "<fg 208>x</fg 208><bg 17>x</bg 17>",
+}
+
+
+def document(size, unit=log_line):
+    """Return markup of roughly size characters, made of whole copies of unit."""
+    if size < len(unit):
+        unit = "<b>x</b>"
+    return unit * max(1, size // len(unit))
+
+
+def dense_document(size, tags_per_100):
+    """Return markup of roughly size characters with the given number of tags per 100 characters of text."""
+    if not tags_per_100:
+        return document(size, "x" * 99 + "\n")
+    gap = max(0, 200 // tags_per_100 - 1)
+    return document(size, "<b>" + "x" * gap + "</b>" + "x" * gap)
+
+
+def calibrate():
+    """A pure-Python workload with an instruction mix similar to that of the parser."""
+    text = "x<b>y</b>" * 200
+    out, pos, table = [], 0, {"b": "1", "/b": "2"}
+    while True:
+        start = text.find("<", pos)
+        if start == -1:
+            break
+        end = text.find(">", start)
+        out.append(text[pos:start])
+        out.append(table.get(text[start + 1 : end], ""))
+        pos = end + 1
+    return "".join(out)
+
+
+def measure(func, min_time=0.02, r=3):
+    """Return the best time of one call to func in seconds."""
+    n, elapsed = 1, 0.0
+    while True:
+        elapsed = Timer(func).timeit(n)
+        if elapsed >= min_time:
+            break
+        n *= max(2, min(100, int(min_time / max(elapsed, 1e-9) * 1.5)))
+    return min([elapsed] + Timer(func).repeat(r - 1, n)) / n
+
+
+def suite_cases(full=False):
+    """Return the cases of the suite as a mapping of names to (function, input size) pairs."""
+    from ansimarkup.__main__ import pipe
+
+    am, cases = AnsiMarkup(), {}
+
+    def add(name, func, size):
+        cases[name] = (func, size)
+
+    sizes = [10, 1 << 10, 100 << 10, 1 << 20]
+    if full:
+        sizes += [10 << 20, 100 << 20]
+    for size in sizes:
+        text = document(size)
+        add("parse size %d" % size, lambda text=text: am.parse(text), len(text))
+        add("strip size %d" % size, lambda text=text: am.strip(text), len(text))
+
+    for depth in 10, 100, 1000:
+        text = nested_markup(depth)
+        add("parse depth %d" % depth, lambda text=text: am.parse(text), len(text))
+
+    for density in 0, 1, 10, 50:
+        text = dense_document(100 << 10, density)
+        add("parse density %d" % density, lambda text=text: am.parse(text), len(text))
+
+    for name, unit in syntaxes.items():
+        text = document(10 << 10, unit)
+        add("parse syntax %s" % name, lambda text=text: am.parse(text), len(text))
+
+    rows = [log_line.strip()] * 1000
+    add("ansistring", lambda: [am.ansistring(i) for i in rows], sum(map(len, rows)))
+
+    instance = AnsiMarkupFormatter("<g>%(asctime)s</g> <b>%(levelname)-8s</b> %(message)s")
+    records = [logging.LogRecord("app", logging.INFO, __file__, 1, i, None, None) for i in rows]
+    add("formatter", lambda: [instance.format(i) for i in records], sum(map(len, rows)))
+
+    tags = {"info": "\033[32m"}
+    add("construct", lambda: [AnsiMarkup(tags=tags).parse(log_line) for _ in range(100)], len(log_line) * 100)
+
+    data = document(10 << 20 if full else 1 << 20).encode()
+    add("cli pipe", lambda: pipe(am, io.BytesIO(data), io.BytesIO()), len(data))
+    return cases
+
+
+def run_suite(full=False, names=None, log=None):
+    """Run the suite and return its results as a JSON-serializable dict."""
+    calibration = measure(calibrate, r=5)
+    results = {}
+    for name, (func, size) in suite_cases(full).items():
+        if names and not any(i in name for i in names):
+            continue
+        seconds = measure(func)
+        results[name] = {"seconds": seconds, "bytes": size, "relative": seconds / calibration}
+        if log:
+            log("  {:<24} {:12.3f} ms {:10.1f} MB/s".format(name, seconds * 1e3, size / seconds / 1e6))
+    return {"calibration": calibration, "python": sys.version.split()[0], "results": results}
+
+
+def compare(results, baseline, tolerance=3.0):
+    """Return the names of the cases that are more than tolerance times slower than the baseline."""
+    slower = []
+    for name, result in results["results"].items():
+        if name in baseline["results"]:
+            if result["relative"] > baseline["results"][name]["relative"] * tolerance:
+                slower.append(name)
+    return slower
+
+
+def suite_main(argv):
+    parser = argparse.ArgumentParser(prog="python tests/perf.py suite")
+    parser.add_argument("--full", action="store_true", help="include inputs of up to 100 MB")
+    parser.add_argument("--json", metavar="path", help="write the results to a file")
+    parser.add_argument("--baseline", metavar="path", default=baseline_path)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=3.0)
+    parser.add_argument("names", nargs="*")
+    opts = parser.parse_args(argv)
+
+    print("suite")
+    results = run_suite(opts.full, opts.names, log=print)
+    if opts.json:
+        with open(opts.json, "w") as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    if opts.update_baseline:
+        with open(opts.baseline, "w") as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    elif os.path.exists(opts.baseline):
+        with open(opts.baseline) as fh:
+            slower = compare(results, json.load(fh), opts.tolerance)
+        for name in slower:
+            print("  regression: %s" % name)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["suite"]:
+        sys.exit(suite_main(sys.argv[2:]))
+
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        benchmarks[name]()
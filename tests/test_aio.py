@@ -0,0 +1,103 @@
+# flake8: noqa
+
+import socket
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pytest import raises
+from colorama import Style as S, Fore as F
+
+from ansimarkup import AnsiMarkup, MismatchedTag
+from ansimarkup.aio import AnsiMarkupWriter
+
+
+class RecordingWriter:
+    """A stream writer that records its writes and drains."""
+
+    def __init__(self):
+        self.calls = []
+
+    def write(self, data):
+        self.calls.append(("write", data))
+
+    async def drain(self):
+        self.calls.append(("drain",))
+        await asyncio.sleep(0)
+
+    def close(self):
+        self.calls.append(("close",))
+
+    def output(self):
+        return b"".join(call[1] for call in self.calls if call[0] == "write")
+
+
+def test_socketpair():
+    async def main():
+        rsock, wsock = socket.socketpair()
+        reader, _writer = await asyncio.open_connection(sock=rsock)
+        _reader, writer = await asyncio.open_connection(sock=wsock)
+
+        async with AnsiMarkupWriter(writer, batch_size=4) as out:
+            await out.write("<b>1")
+            await out.write("</b><r>2</r> <tag>")
+            await out.ansiprint("<g>3</g>", out.ansimarkup.raw("<b>"), 4, sep="|")
+        res = await reader.read()
+        _writer.close()
+        await _writer.wait_closed()
+        return res
+
+    res = asyncio.run(main())
+    expected = S.BRIGHT + "1" + S.RESET_ALL + F.RED + "2" + S.RESET_ALL + " <tag>" + F.GREEN + "3" + S.RESET_ALL
+    assert res.decode() == expected + "|<b>|4\n"
+
+
+def test_batches():
+    async def main(**kwargs):
+        writer = RecordingWriter()
+        out = AnsiMarkupWriter(writer, **kwargs)
+        await out.write("<b>1</b>")
+        await out.write("2" * 10)
+        await out.write("<r>" + "3" * 25 + "</r>")
+        await out.close()
+        return writer
+
+    writer = asyncio.run(main(batch_size=10))
+    assert writer.output().decode() == AnsiMarkup().parse("<b>1</b>" + "2" * 10 + "<r>" + "3" * 25 + "</r>")
+    assert [call[0] for call in writer.calls] == ["write", "drain"] * 4 + ["drain", "close"]
+    assert max(len(call[1]) for call in writer.calls if call[0] == "write") <= 20
+
+    writer = asyncio.run(main(encoding=None, strip=True))
+    assert writer.calls == [("write", "1" + "2" * 10 + "3" * 25), ("drain",), ("close",)]
+
+
+def test_executor():
+    threads = []
+    am = AnsiMarkup(tags={"thread": lambda: threads.append(threading.current_thread()) or F.BLUE})
+    markup = "<b>1</b>" + "<thread>2</thread>" * 10
+
+    async def main(**kwargs):
+        writer = RecordingWriter()
+        out = AnsiMarkupWriter(writer, am, batch_size=20, **kwargs)
+        await out.write(markup)
+        await out.write("<thread>3</thread>")
+        await out.close()
+        return writer.output().decode()
+
+    with ThreadPoolExecutor(1) as executor:
+        assert asyncio.run(main(executor_threshold=100, executor=executor)) == am.parse(markup + "<thread>3</thread>")
+    assert threads[-1] is threading.current_thread()
+    assert len({i for i in threads if i is not threading.current_thread()}) == 1
+
+
+def test_strict():
+    writer = RecordingWriter()
+
+    async def main():
+        out = AnsiMarkupWriter(writer, AnsiMarkup(strict=True))
+        await out.write("<b>1")
+        await out.close()
+
+    with raises(MismatchedTag):
+        asyncio.run(main())
+    assert writer.calls[-1] == ("close",)
@@ -0,0 +1,81 @@
+# flake8: noqa
+
+import io
+import os
+import sys
+import subprocess
+
+from colorama import Style as S, Fore as F
+
+from ansimarkup import AnsiMarkup
+from ansimarkup.__main__ import pipe
+
+
+def run(*args, stdin=b"", env=None):
+    cmd = [sys.executable, "-m", "ansimarkup", *args]
+    return subprocess.run(cmd, input=stdin, capture_output=True, env=dict(os.environ, **env) if env else None)
+
+
+def test_args():
+    res = run("<b>1</b>", "<r>2</r>")
+    assert res.stdout.decode() == S.BRIGHT + "1" + S.RESET_ALL + " " + F.RED + "2" + S.RESET_ALL + "\n"
+
+    res = run("--strip", "<b>1</b>", "<r>2</r>")
+    assert res.stdout.decode() == "1 2\n"
+
+    res = run("--strip", "--strict", "<b>1", "</b><tag>")
+    assert res.stdout.decode() == "1 <tag>\n"
+
+    res = run("--strip", "--strict", "<b>1</b>", "<r>2")
+    assert res.returncode == 1
+    assert b"has no corresponding closing tag" in res.stderr
+
+
+def test_color():
+    res = run("--color", "never", "<b>1</b>", "<r>2</r>")
+    assert res.stdout.decode() == "1 2\n"
+
+    res = run("--color", "auto", stdin=b"<b>1</b><tag>\n", env={"NO_COLOR": "", "FORCE_COLOR": ""})
+    assert res.stdout == b"1<tag>\n"
+
+    res = run("--color", "auto", stdin=b"<b>1</b>", env={"FORCE_COLOR": "1"})
+    assert res.stdout.decode() == S.BRIGHT + "1" + S.RESET_ALL
+
+    res = run("--color", "sometimes", "<b>1</b>")
+    assert res.returncode == 1
+
+
+def test_stdin():
+    res = run(stdin=b"<b>1\n2</b>\n<r>3</r>\n")
+    assert res.stdout.decode() == S.BRIGHT + "1\n2" + S.RESET_ALL + "\n" + F.RED + "3" + S.RESET_ALL + "\n"
+
+    res = run("--strip", stdin=b"<b>1\n2</b>\n<tag>3</tag>\n")
+    assert res.stdout == b"1\n2\n<tag>3</tag>\n"
+
+    res = run("--tag-sep", "{}", stdin=b"{b}1{/b}<b>")
+    assert res.stdout.decode() == S.BRIGHT + "1" + S.RESET_ALL + "<b>"
+
+    res = run("--strict", stdin=b"<b>1\n")
+    assert res.returncode == 1
+    assert b"has no corresponding closing tag" in res.stderr
+
+    res = run("--strict", "--strip", stdin=b"<b>1\n")
+    assert res.returncode == 1
+    assert b"has no corresponding closing tag" in res.stderr
+
+    res = run("--strict", "--strip", stdin=b"<b>1\n</r>")
+    assert b"has no corresponding opening tag" in res.stderr
+
+    res = run("--strict", "--strip", stdin=b"<b>1\n</b><tag>")
+    assert res.stdout == b"1\n<tag>"
+
+
+def test_pipe_blocks(monkeypatch):
+    import ansimarkup.__main__ as main
+
+    monkeypatch.setattr(main, "block_size", 3)
+    markup = "<b>bold</b> \xe9\xe9 <fg 200>xterm</fg 200>\n" * 10
+    infile, outfile = io.BytesIO(markup.encode("utf8") + b"\xff"), io.BytesIO()
+
+    pipe(AnsiMarkup(), infile, outfile)
+    assert outfile.getvalue() == AnsiMarkup().parse(markup).encode("utf8") + b"\xff"
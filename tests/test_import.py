@@ -0,0 +1,34 @@
+import os
+import re
+import sys
+import subprocess
+
+import ansimarkup
+
+
+# Budget for the cumulative import time of the package, in microseconds. It
+# is generous, as the time depends on the machine and its load.
+import_budget = 30000
+
+
+def python(*args):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(ansimarkup.__file__)))
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return subprocess.run([sys.executable, *args], capture_output=True, env=env, text=True, check=True)
+
+
+def test_import_is_lazy():
+    code = "import sys, ansimarkup; print('colorama' in sys.modules, '_ansimarkup' in vars(ansimarkup))"
+    assert python("-c", code).stdout.split() == ["False", "False"]
+
+    code = "from ansimarkup import parse; import ansimarkup; print(parse.__self__ is ansimarkup._ansimarkup)"
+    assert python("-c", code).stdout.split() == ["True"]
+
+
+def test_import_time():
+    # The first run writes the bytecode cache.
+    times = []
+    for i in range(4):
+        stderr = python("-X", "importtime", "-c", "import ansimarkup").stderr
+        times.append(int(re.search(r"(\d+) \| ansimarkup$", stderr, re.M).group(1)))
+    assert min(times[1:]) < import_budget
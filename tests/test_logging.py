@@ -1,13 +1,14 @@
 # flake8: noqa
 
-import io, sys
+import io, sys, queue
 import logging
+import logging.handlers
 
 from pytest import raises, mark, fixture
 from colorama import Style as S, Fore as F, Back as B
 
-from ansimarkup.logformatter import AnsiMarkupFormatter
-from ansimarkup import parse as p
+from ansimarkup.logformatter import AnsiMarkupFormatter, AnsiMarkupStreamHandler, AnsiMarkupQueueHandler
+from ansimarkup import parse as p, AnsiMarkup, AnsiMarkupError
 
 
 class CaptureLogHandler(logging.StreamHandler):
@@ -53,3 +54,160 @@ def test_basic(caplog):
 
     log.info("<b>1</b>")
     assert hdl.last_msg == S.BRIGHT + "1" + S.RESET_ALL
+
+
+class LegacyFormatter(AnsiMarkupFormatter):
+    """Formats and parses every record as a whole."""
+
+    def format(self, record):
+        return self.ansimarkup.parse(logging.Formatter.format(self, record))
+
+
+def make_record(msg, *args, exc_info=None):
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, msg, args, exc_info)
+    record.created = record.msecs = 0
+    return record
+
+
+@mark.parametrize(
+    "fmt, style",
+    [
+        ("<b>%(levelname)s</b> %(name)s: %(message)s", "%"),
+        ("<r>%(levelname)-8s %(message)s</r> <g>done</g>", "%"),
+        ("<b>[%(asctime)s]</b> %(message)-20s|", "%"),
+        ("<b>{levelname}</b> <u>{message}</u>", "{"),
+        ("<b>{levelname}</b> {message!r}", "{"),
+        ("<b>$levelname</b> <u>${message}</u> $$", "$"),
+        ("<fg %(name)s>%(message)s</fg %(name)s>", "%"),
+        ("%(message)s %(message)s</b>", "%"),
+        ("100%% <b>%(message)s</b>", "%"),
+    ],
+)
+def test_compiled_format(fmt, style):
+    new, old = AnsiMarkupFormatter(fmt, style=style), LegacyFormatter(fmt, style=style)
+    messages = ["plain", "<r>red</r>", "<b>bold", "</b>reset", "</r>close", "<tag>text</tag>", "100%"]
+
+    def format(formatter, msg, exc_info=None):
+        try:
+            return formatter.format(make_record(msg, exc_info=exc_info))
+        except AnsiMarkupError as error:
+            return type(error)
+
+    for msg in messages:
+        assert format(new, msg) == format(old, msg)
+        assert new.format_plain(make_record(msg)) == old.ansimarkup.strip(
+            logging.Formatter.format(old, make_record(msg))
+        )
+
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        exc_info = sys.exc_info()
+    assert format(new, "<r>error</r>", exc_info) == format(old, "<r>error</r>", exc_info)
+
+    # The separator before the traceback is the same for parsed and stripped output.
+    for msg in "error\n", "<r>error</r>\n":
+        record = make_record(msg, exc_info=exc_info)
+        record.stack_info = "Stack (most recent call last):"
+        assert format(new, msg, exc_info) == format(old, msg, exc_info)
+        assert new.format_plain(record) == old.ansimarkup.strip(logging.Formatter.format(old, record))
+
+
+def test_compiled_format_template():
+    fmt = AnsiMarkupFormatter("<b>%(levelname)s</b> %(message)s")
+    assert fmt.template is not None
+    assert fmt.format(make_record("<r>%s</r>", 1)) == S.BRIGHT + "INFO" + S.RESET_ALL + " " + F.RED + "1" + S.RESET_ALL
+
+    # Fields that form tags and markup fields with conversions are parsed along with the record.
+    assert AnsiMarkupFormatter("<fg %(name)s>%(message)s</fg %(name)s>").template is None
+    assert AnsiMarkupFormatter("%(message)10s").template is None
+    assert AnsiMarkupFormatter("%(message)s", markup_fields=()).format(make_record("<b>1</b>")) == "<b>1</b>"
+
+
+def test_record_pickle():
+    import pickle
+
+    record = make_record("<b>1</b>")
+    AnsiMarkupFormatter().format(record)
+    AnsiMarkupFormatter().format_plain(record)
+    assert "_ansimarkup" not in vars(pickle.loads(pickle.dumps(record)))
+    logging.handlers.SocketHandler("localhost", 0).makePickle(record)
+
+
+def test_stream_handler(monkeypatch, tty):
+    for name in ("NO_COLOR", "FORCE_COLOR", "TERM"):
+        monkeypatch.delenv(name, raising=False)
+
+    log = logging.Logger("test")
+    hdl = AnsiMarkupStreamHandler(io.StringIO())
+    log.addHandler(hdl)
+
+    log.info("<b>1</b>")
+    assert hdl.colors is False
+    assert hdl.stream.getvalue() == "1\n"
+
+    hdl.setStream(tty)
+    log.info("<b>1</b>")
+    assert hdl.colors is True
+    assert hdl.stream.getvalue() == S.BRIGHT + "1" + S.RESET_ALL + "\n"
+
+    hdl.setFormatter(AnsiMarkupFormatter("<r>%(levelname)s</r> %(message)s"))
+    log.info("<b>1</b>")
+    assert hdl.stream.getvalue().splitlines()[-1] == F.RED + "INFO" + S.RESET_ALL + " " + S.BRIGHT + "1" + S.RESET_ALL
+
+    hdl.setStream(io.StringIO())
+    log.info("<b>1</b>")
+    assert hdl.stream.getvalue() == "INFO 1\n"
+
+    hdl = AnsiMarkupStreamHandler(io.StringIO(), colors=True)
+    hdl.setStream(io.StringIO())
+    assert hdl.colors is True
+
+
+def test_queue_handler(tty):
+    stream, records = tty, queue.Queue()
+    handler = AnsiMarkupStreamHandler(stream)
+    handler.setFormatter(AnsiMarkupFormatter("<b>%(levelname)s</b> %(message)s"))
+    listener = logging.handlers.QueueListener(records, handler)
+
+    log = logging.Logger("test")
+    log.addHandler(AnsiMarkupQueueHandler(records))
+
+    log.info("<r>%s</r>", "<1>")
+    record = records.queue[0]
+    assert (record.msg, record.args, record.exc_text) == ("<r><1></r>", None, None)
+
+    listener.start()
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        log.exception("<g>2</g>")
+    listener.stop()
+
+    lines = stream.getvalue().splitlines()
+    assert lines[0] == S.BRIGHT + "INFO" + S.RESET_ALL + " " + F.RED + "<1>" + S.RESET_ALL
+    assert lines[1] == S.BRIGHT + "ERROR" + S.RESET_ALL + " " + F.GREEN + "2" + S.RESET_ALL
+    assert lines[-1] == "ZeroDivisionError: division by zero"
+
+
+def test_shared_parse(monkeypatch, tty):
+    compile = AnsiMarkup.compile
+    calls = []
+
+    def counting_compile(self, markup):
+        calls.append(markup)
+        return compile(self, markup)
+
+    color, plain = tty, io.StringIO()
+    log = logging.Logger("test")
+    for stream in color, plain:
+        hdl = AnsiMarkupStreamHandler(stream)
+        hdl.setFormatter(AnsiMarkupFormatter("<b>%(levelname)s</b> %(message)s"))
+        log.addHandler(hdl)
+
+    monkeypatch.setattr(AnsiMarkup, "compile", counting_compile)
+    log.info("<r>1</r>")
+
+    assert calls == ["<r>1</r>"]
+    assert color.getvalue() == S.BRIGHT + "INFO" + S.RESET_ALL + " " + F.RED + "1" + S.RESET_ALL + "\n"
+    assert plain.getvalue() == "INFO 1\n"
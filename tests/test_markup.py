@@ -1,12 +1,15 @@
 # flake8: noqa
 
 import io
+from collections import ChainMap
+from textwrap import TextWrapper
 
 from pytest import raises, mark
 from colorama import Style as S, Fore as F, Back as B
 
 from ansimarkup import AnsiMarkup, MismatchedTag, UnbalancedTag
-from ansimarkup import parse as p, strip as s
+from ansimarkup import markup, parse as p, strip as s, alias, cached
+from ansimarkup.sgr import DEFAULT
 
 
 def test_flat():
@@ -289,3 +292,755 @@ def test_ansiprint(am):
     f = io.StringIO()
     am.ansiprint("<b><r>", am.raw("</b</r>RAW"), "</r></b>", file=f, end="")
     assert " </b</r>RAW " in f.getvalue()
+
+
+def test_compile(am):
+    for markup in ("<b>1</b>", "0<b>1<d>2</d>3</b>4", "<tag>1</tag>", "<b>1", ""):
+        compiled = am.compile(markup)
+        assert compiled.render() == compiled() == am.parse(markup)
+        assert compiled.render(aslist=True) == am.parse(markup, aslist=True)
+
+    assert am.compile("<b>1<r>2").open_tags == ("b", "r")
+
+    with raises(MismatchedTag):
+        am.compile("<b>1</d>")
+
+    am = AnsiMarkup(strict=True)
+    compiled = am.compile("<b>1")
+    with raises(MismatchedTag):
+        compiled.render()
+
+
+def test_compile_renderers(am):
+    for markup in corpus:
+        compiled = am.compile(markup)
+        assert compiled.strip() == am.strip(markup)
+        assert "".join(text for text, state in compiled.spans()) == am.strip(markup)
+
+    compiled = am.compile("<b>1<r>2</r></b>3<fg 16>4</fg 16><bg #102030>&</bg #102030><R><u>5</u></R><tag>")
+    assert [(text, state and state._asdict()) for text, state in compiled.spans()][:3] == [
+        ("1", dict(DEFAULT._asdict(), bold=True)),
+        ("2", dict(DEFAULT._asdict(), bold=True, fg="31")),
+        ("3", DEFAULT._asdict()),
+    ]
+    assert compiled.html() == (
+        '<span style="font-weight: bold">1</span>'
+        '<span style="color: #cd0000; font-weight: bold">2</span>3'
+        '<span style="color: #000000">4</span>'
+        '<span style="background-color: #102030">&amp;</span>'
+        '<span style="background-color: #cd0000; text-decoration: underline">5</span>&lt;tag&gt;'
+    )
+
+    # The grayscale ramp of the 256 xterm colors.
+    compiled = am.compile("<fg 232>1</fg 232><bg 255>2</bg 255>")
+    assert [state.fg or state.bg for text, state in compiled.spans()] == ["38;5;232", "48;5;255"]
+    assert compiled.html() == '<span style="color: #080808">1</span><span style="background-color: #eeeeee">2</span>'
+
+
+def test_template(am):
+    t = am.template("<r>{user}</r> <b>{0:>4}</b> {{x}} {1!r}")
+    assert t.render(1, "<b>", user="<admin>") == t(1, "<b>", user="<admin>")
+    assert (
+        t(1, "<b>", user="<admin>")
+        == F.RED + "<admin>" + S.RESET_ALL + " " + S.BRIGHT + "   1" + S.RESET_ALL + " {x} '<b>'"
+    )
+
+    assert am.template("<b>{}{}")("1", "2") == S.BRIGHT + "12"
+    am_reset = AnsiMarkup(always_reset=True)
+    assert am_reset.template("<b>{}</b>")("1") == am_reset.parse("<b>1</b>")
+    assert AnsiMarkup(minimal=True).template("<b><r>{}</r></b>")("1") == "\x1b[1;31m1\x1b[0m"
+    assert AnsiMarkup(tags={"c": "{c}"}).template("<c>{}</c>")("1") == "{c}1" + S.RESET_ALL
+
+    with raises(MismatchedTag):
+        AnsiMarkup(strict=True).template("<b>{}")("1")
+    with raises(MismatchedTag):
+        am.template("<b>{}</r>")
+    with raises(ValueError):
+        am.template("<b>{</b>")
+    with raises(ValueError):
+        AnsiMarkup(tag_sep="{}").template("{b}{}{/b}")
+
+    colors = iter([F.BLUE, F.RED, F.GREEN])
+    t = AnsiMarkup(tags={"c": lambda: next(colors)}).template("<c>{}</c>")
+    assert t("1") == F.RED + "1" + S.RESET_ALL
+    assert t("1") == F.GREEN + "1" + S.RESET_ALL
+
+
+def test_cache():
+    am = AnsiMarkup(cache_size=2)
+    assert am.cache_info() == (0, 0, 2, 0)
+
+    assert am.parse("<b>1</b>") == am.parse("<b>1</b>") == S.BRIGHT + "1" + S.RESET_ALL
+    assert am.cache_info() == (1, 1, 2, 1)
+
+    am.parse("<r>1</r>")
+    am.parse("<b>1</b>")
+    am.parse("<d>1</d>")
+    assert am.cache_info() == (2, 3, 2, 2)
+    assert list(am._cache) == ["<b>1</b>", "<d>1</d>"]
+
+    # Raw strings and multiple arguments are not cached.
+    assert am.parse(am.raw("<r>1</r>")) == "<r>1</r>"
+    am.parse("<b>", "1</b>")
+    assert am.cache_info() == (2, 3, 2, 2)
+
+    am.cache_clear()
+    assert am.cache_info() == (0, 0, 2, 0)
+
+
+def test_cache_options():
+    am = AnsiMarkup(cache_size=10)
+    assert am.parse("<b>1") == S.BRIGHT + "1"
+
+    am.always_reset = True
+    assert am.parse("<b>1") == S.BRIGHT + "1" + S.RESET_ALL
+
+    am.strict = True
+    with raises(MismatchedTag):
+        am.parse("<b>1")
+
+    with raises(MismatchedTag):
+        am.parse("<b>1</d>")
+    assert "<b>1</d>" not in am._cache
+
+
+def test_cache_user_tags():
+    am = AnsiMarkup(tags={"info": F.GREEN}, cache_size=10)
+    assert am.parse("<info>1</info>") == F.GREEN + "1" + S.RESET_ALL
+
+    am.user_tags["info"] = F.RED
+    assert am.parse("<info>1</info>") == F.RED + "1" + S.RESET_ALL
+
+    am.user_tags = {"info": F.BLUE}
+    assert am.parse("<info>1</info>") == F.BLUE + "1" + S.RESET_ALL
+
+    del am.user_tags["info"]
+    assert am.parse("<info>1</info>") == "<info>1</info>"
+
+    colors = iter([F.RED, F.BLUE])
+    am.user_tags.update(call=lambda: next(colors))
+    assert am.parse("<call>1</call>") == F.RED + "1" + S.RESET_ALL
+    assert am.parse("<call>1</call>") == F.BLUE + "1" + S.RESET_ALL
+
+    # The given mapping is kept, and changes to it take effect.
+    tags = {"info": F.GREEN}
+    am = AnsiMarkup(tags=tags, cache_size=10)
+    assert am.user_tags is tags
+    assert am.parse("<info>1</info>") == F.GREEN + "1" + S.RESET_ALL
+    tags["info"] = F.RED
+    assert am.parse("<info>1</info>") == F.RED + "1" + S.RESET_ALL
+
+    theme = ChainMap({}, {"info": F.GREEN})
+    am = AnsiMarkup(tags=theme)
+    compiled = am.compile("<info>1</info>")
+    theme.maps[0]["info"] = F.BLUE
+    assert compiled() == am.parse("<info>1</info>") == F.BLUE + "1" + S.RESET_ALL
+
+
+def test_user_tag_aliases():
+    am = AnsiMarkup(tags={"error": alias("<b><r>"), "fatal": alias("<error><Y>"), "info": F.GREEN})
+    assert am.parse("<error>1</error>") == S.BRIGHT + F.RED + "1" + S.RESET_ALL
+    assert am.parse("<fatal>1</fatal>") == S.BRIGHT + F.RED + B.YELLOW + "1" + S.RESET_ALL
+    assert (
+        am.parse("<b><error>1</error>2</b>")
+        == S.BRIGHT + S.BRIGHT + F.RED + "1" + S.RESET_ALL + S.BRIGHT + "2" + S.RESET_ALL
+    )
+
+    # Aliases are expanded before they are used.
+    assert am._user_codes["fatal"] == S.BRIGHT + F.RED + B.YELLOW
+    am.user_tags["error"] = alias("<info>")
+    assert am.parse("<fatal>1</fatal>") == F.GREEN + B.YELLOW + "1" + S.RESET_ALL
+
+    # Aliases that refer to callables are expanded on every use.
+    colors = iter([F.RED, F.BLUE])
+    am.user_tags.update(call=lambda: next(colors), warn=alias("<call><u>"))
+    assert am.parse("<warn>1</warn>") == F.RED + "\x1b[4m1" + S.RESET_ALL
+    assert am.parse("<warn>1</warn>") == F.BLUE + "\x1b[4m1" + S.RESET_ALL
+
+    # Errors are raised when the changed tags are used.
+    am.user_tags["error"] = alias("<fatal>")
+    with raises(ValueError, match="error -> fatal -> error"):
+        am.parse("<fatal>1</fatal>")
+    with raises(ValueError, match="error -> fatal -> error"):
+        am.strip("<fatal>1</fatal>")
+    am.user_tags["error"] = alias("<info>")
+    assert am.parse("<fatal>1</fatal>") == F.GREEN + B.YELLOW + "1" + S.RESET_ALL
+
+    with raises(ValueError, match="a -> a"):
+        AnsiMarkup(tags={"a": alias("<a>")}).parse("<a>")
+    with raises(ValueError):
+        AnsiMarkup(tags={"a": alias("</b>")}).strip("<b>")
+
+
+def test_cached_user_tags(monkeypatch):
+    calls, now = [], [0.0]
+    monkeypatch.setattr(markup, "monotonic", lambda: now[0])
+
+    def theme():
+        calls.append(1)
+        return [F.RED, F.GREEN, F.BLUE][len(calls) - 1]
+
+    am = AnsiMarkup(tags={"c": cached(theme), "t": cached(lambda: F.BLUE, ttl=10), "w": alias("<c><u>")})
+    compiled, template = am.compile("<c>1</c>"), am.template("<c>{}</c>")
+    assert not compiled.dynamic
+    assert am.parse("<c>1</c>") == compiled() == template("1") == F.RED + "1" + S.RESET_ALL
+    assert am.parse("<w>1</w>") == F.RED + "\x1b[4m1" + S.RESET_ALL
+    assert am.strip("<c>1</c>") == "1"
+    assert len(calls) == 1
+
+    am.refresh_tags()
+    assert compiled() == am.parse("<c>1</c>") == template("1") == F.GREEN + "1" + S.RESET_ALL
+    assert am.parse("<w>1</w>") == F.GREEN + "\x1b[4m1" + S.RESET_ALL
+    assert len(calls) == 2
+
+    # Cached tags are refreshed once the earliest of their TTLs has passed.
+    assert am.parse("<t>1</t>") == F.BLUE + "1" + S.RESET_ALL
+    now[0] = 5
+    am.parse("<c>1</c>")
+    assert len(calls) == 2
+    now[0] = 10
+    assert compiled() == F.BLUE + "1" + S.RESET_ALL
+    assert len(calls) == 3
+
+    with raises(ValueError):
+        am.config()
+
+
+def test_instrument():
+    am = AnsiMarkup(tags={"e": alias("<b>")}, cache_size=4)
+    with raises(ValueError):
+        am.stats()
+    stream = am.stream()
+
+    slow = []
+    am.instrument(slow_threshold=0, on_slow=lambda *args: slow.append(args))
+    markup = "<e>1</e><b>2</b><fg #fff>3</fg #fff><r,y>4</r,y><nope>"
+    res = am.parse(markup)
+    assert am.parse(markup) == res == AnsiMarkup(tags={"e": S.BRIGHT}).parse(markup)
+    assert am.strip("<b>1</b>") == "1"
+    assert am.ansistring("<b>1</b>") == S.BRIGHT + "1" + S.RESET_ALL
+
+    stats = am.stats()
+    assert stats.calls == {"parse": 2, "strip": 1, "ansistring": 1}
+    assert stats.tags == {"user": 1, "all_tags": 3, "extended": 1, "shorthand": 1, "unknown": 1}
+    assert (stats.cache_hits, stats.cache_misses) == (1, 1)
+    assert stats.chars_in == len(markup) * 2 + 16
+    assert stats.chars_out == len(res) * 2 + 1 + len(S.BRIGHT + "1" + S.RESET_ALL)
+    assert stats.time > 0
+    assert [i[:2] for i in slow] == [
+        ("parse", (markup,)),
+        ("parse", (markup,)),
+        ("strip", ("<b>1</b>",)),
+        ("ansistring", ("<b>1</b>",)),
+    ]
+
+    # Calls that raise are counted and timed, and so are the tags of streams
+    # that were created before instrument().
+    with raises(MismatchedTag):
+        am.parse("</b>")
+    assert stream.feed("<r>1") == F.RED + "1"
+    stats = am.stats()
+    assert stats.calls["parse"] == 3
+    assert stats.tags["all_tags"] == 4
+    assert slow[-1][:2] == ("parse", ("</b>",))
+
+    # Instrumentation leaves no trace on the instance once it is disabled.
+    am.instrument(False)
+    assert not {"parse", "strip", "ansistring", "_sub", "_clear", "_strip"} & set(vars(am))
+    with raises(ValueError):
+        am.stats()
+
+
+def test_tag_table():
+    calls = []
+    am = AnsiMarkup(tags={"info": F.GREEN, "call": lambda: calls.append(1) or F.BLUE})
+
+    am.parse("<fg #ff8800>1</fg #ff8800><b,r,w>2</b,r,w><nope>3</nope><info>4</info>")
+    assert markup.builtin_tag_table["fg #ff8800"] == "\x1b[38;2;255;136;0m"
+    assert markup.builtin_tag_table["b,r,w"] == S.BRIGHT + F.RED + B.WHITE
+    assert markup.builtin_tag_table["nope"] is None
+    assert am._tag_table["info"] == F.GREEN
+
+    # Callable user tags are called on every use.
+    assert am.parse("<call>1</call><call>2</call>") == F.BLUE + "1" + S.RESET_ALL + F.BLUE + "2" + S.RESET_ALL
+    assert len(calls) == 2
+
+    am.user_tags["info"] = F.RED
+    assert am.parse("<info>1</info>") == F.RED + "1" + S.RESET_ALL
+
+    # Only user tags are kept per instance.
+    for i in range(10):
+        am.parse("<tag%d>" % i)
+    assert sorted(am._tag_table) == ["call", "info"]
+    assert "tag9" in markup.builtin_tag_table
+
+    class Custom(AnsiMarkup):
+        def resolve_tag(self, tag):
+            return super().resolve_tag(tag)
+
+    custom = Custom()
+    custom.tag_table_size = 4
+    for i in range(10):
+        custom.parse("<tag%d>" % i)
+    assert len(custom._tag_table) <= 4
+
+
+def test_engine():
+    assert AnsiMarkup().engine == "scan"
+    with raises(ValueError):
+        AnsiMarkup(engine="lex")
+
+
+@mark.parametrize("tag_sep", ["<>", "{}"])
+def test_engine_differential(tag_sep):
+    import random
+
+    pieces = [
+        "<b>", "</b>", "<r>", "</r>", "<Y>", "</Y>", "<tag>", "</tag>", "<b,r,y>", "</b,r,y>",
+        "<fg #f00>", "</fg #f00>", "<bg 120>", "</bg 120>", "<>", "</>", "<//b>", "<<b>", "</<b>",
+        "<", ">", "</", "/", "x", "yz", " ", "<b", "b>", "{", "}",
+    ]  # fmt: skip
+    table = str.maketrans("<>{}", tag_sep + "<>")
+    pieces = [i.translate(table) for i in pieces]
+
+    def run(am, method, text):
+        try:
+            return method(am, text)
+        except Exception as error:
+            return type(error)
+
+    scan = AnsiMarkup(tag_sep=tag_sep, engine="scan")
+    regex = AnsiMarkup(tag_sep=tag_sep, engine="regex")
+
+    rand = random.Random(1)
+    for _ in range(3000):
+        text = "".join(rand.choice(pieces) for _ in range(rand.randint(0, 12)))
+        for method in AnsiMarkup.parse, AnsiMarkup.strip:
+            assert run(scan, method, text) == run(regex, method, text), text
+
+
+def test_deep_nesting(am):
+    depth = 500
+    markup = "<b>" * depth + "<r>x</r>" + "</b>" * depth
+    res = am.parse(markup)
+    assert res.startswith(S.BRIGHT * depth + F.RED + "x" + S.RESET_ALL + S.BRIGHT * depth)
+    assert res.endswith(S.RESET_ALL + S.BRIGHT + S.RESET_ALL)
+
+    with raises(UnbalancedTag):
+        am.parse("<r>" + "<b>" * depth + "</r>")
+
+
+# Well-formed markup from the tests above.
+corpus = [
+    "<b>1</b>", "<bold>1</bold>", "<d>1</d>", "<b>1</b><d>2</d>", "<b>1</b>2<d>3</d>",
+    "<r>1</r>", "<fg red>1</fg red>", "<R>1</R>", "<bg red>1</bg red>", "<r,y>1</r,y>",
+    "<b,r,y>1</b,r,y>", "<b,r,>1</b,r,>", "<fg RED>1</fg RED>", "<z,z>1</z,z>",
+    "<fg 200>1</fg 200>", "<bg 100><fg 200>1", "<fg #ff0000>1", "<bg #00A000><fg #ff0000>1",
+    "<fg #F12>1</fg #F12>", "<fg 255,0,0>1", "<bg 0,160,0><fg 255,0,0>1",
+    "0<b>1<d>2</d>3</b>4", "<d>0<b>1<d>2</d>3</b>4</d>", "<tag>1</tag>", "<b>1</b><tag>2</tag><b>3</b>",
+    "<b><tag>1</tag></b>", "<tag><b>1</b></tag>", "<b><tag>1</tag>", "<b></tag>", "<r>2 > 1</r>",
+    "<r>1 </ 2</r>", "{: <10}<r>1</r>", "<1<r>2 < 3</r>4>", "A <b>bold</b> tag.",
+    "<b><r>red bold</r></b>", "<r><b>red bold</b>red</r><b>bold</b>", "<i><u><s>1</s>2</u>3</i>",
+    "<r><Y>1</Y>2</r>", "<b><d>1</d></b>", "<v><h>1</h></v><l>2</l>", "<b>1</b><b>2</b>",
+]  # fmt: skip
+
+
+def render_styles(text):
+    """Return each printed character along with the terminal state it is printed in."""
+    from ansimarkup.sgr import apply, DEFAULT
+    import re
+
+    state, res = DEFAULT, []
+    for part in re.split(r"(\x1b\[[0-9;]*m)", text):
+        if part.startswith("\x1b["):
+            state = apply(state, part)
+        else:
+            res.extend((char, state) for char in part)
+    return res, state
+
+
+def test_minimal():
+    am = AnsiMarkup(minimal=True)
+
+    assert am.parse("<b><r>1</r></b>") == "\x1b[1;31m1\x1b[0m"
+    assert am.parse("<b>1<r>2</r>3</b>") == "\x1b[1m1\x1b[31m2\x1b[39m3\x1b[0m"
+    assert am.parse("<r><Y>1</Y>2</r>") == "\x1b[31;43m1\x1b[49m2\x1b[0m"
+    assert am.parse("<b>1</b><b>2</b>") == "\x1b[1m12\x1b[0m"
+    assert am.parse("<b>1</b>2<d>3</d>") == "\x1b[1m1\x1b[0m2\x1b[2m3\x1b[0m"
+    assert am.parse("<b><tag>1</tag>") == "\x1b[1m<tag>1</tag>"
+    assert am.parse("<b>", "1", "</b>", aslist=True) == ["\x1b[1m", "1", "\x1b[0m"]
+
+    # Escape codes that are not SGR sequences are passed through.
+    am = AnsiMarkup(tags={"title": "\x1b]0;title\x07"}, minimal=True)
+    assert am.parse("<b>1<title>2</title></b>") == "\x1b[1m1\x1b]0;title\x072\x1b[0m"
+
+
+def test_minimal_corpus():
+    am, minimal = AnsiMarkup(), AnsiMarkup(minimal=True)
+
+    total, saved = 0, 0
+    for markup in corpus:
+        expected, res = am.parse(markup), minimal.parse(markup)
+        assert render_styles(res) == render_styles(expected), markup
+        assert len(res) <= len(expected), markup
+        total, saved = total + len(expected), saved + len(expected) - len(res)
+
+    assert saved / total > 0.1
+
+
+def test_stream(am):
+    stream = am.stream()
+    assert stream.feed("<b>ab") == S.BRIGHT + "ab"
+    assert stream.feed("c</") == "c"
+    assert stream.feed("b") == ""
+    assert stream.feed("> <r") == S.RESET_ALL + " "
+    assert stream.feed(">1") == F.RED + "1"
+    assert stream.feed(am.raw("<b>")) == "<b>"
+    assert stream.close() == ""
+
+    # Incomplete tags are passed through once the stream is closed.
+    stream = am.stream()
+    assert stream.feed("1 <") == "1 "
+    assert stream.close() == "<"
+
+    # Tags longer than max_tag_length are not held back.
+    stream = am.stream(max_tag_length=4)
+    assert stream.feed("<fg 1") == "<fg 1"
+    assert stream.feed("0>") == "0>"
+
+
+def test_stream_options():
+    stream = AnsiMarkup(strict=True).stream()
+    stream.feed("<b>1")
+    with raises(MismatchedTag):
+        stream.close()
+
+    stream = AnsiMarkup(always_reset=True).stream()
+    assert stream.feed("<b>1") == S.BRIGHT + "1"
+    assert stream.close() == S.RESET_ALL
+
+    stream = AnsiMarkup(minimal=True).stream()
+    assert stream.feed("<b><r>1</r></b") == "\x1b[1;31m1"
+    assert stream.feed(">") == ""
+    assert stream.feed("<d>2</d>") == "\x1b[0;2m2"
+    assert stream.close() == "\x1b[0m"
+
+
+def test_unclosed_depth():
+    import tracemalloc
+
+    # The stack only keeps the codes of each depth, so its size is linear.
+    am, depth = AnsiMarkup(), 20000
+    stream = am.stream()
+    tracemalloc.start()
+    res = [stream.feed("<fg 200>" * 100) for _ in range(depth // 100)]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert "".join(res) == am.parse("<fg 200>" * depth)
+    assert peak < 10 << 20
+    assert stream.feed("x</fg 200>") == "x" + S.RESET_ALL + "\x1b[38;5;200m" * (depth - 1)
+
+
+@mark.parametrize("tag_sep", ["<>", "{}"])
+def test_stream_chunks(tag_sep):
+    import random
+
+    am = AnsiMarkup(tag_sep=tag_sep)
+    table = str.maketrans("<>{}", tag_sep + "<>")
+    rand = random.Random(1)
+
+    for markup in corpus:
+        markup = markup.translate(table)
+        for _ in range(20):
+            stream, res, pos = am.stream(), [], 0
+            while pos < len(markup):
+                size = rand.randint(0, 4)
+                res.append(stream.feed(markup[pos : pos + size]))
+                pos += size
+            res.append(stream.close())
+            assert "".join(res) == am.parse(markup), markup
+
+
+@mark.parametrize("options", [{}, {"minimal": True}, {"always_reset": True}])
+def test_iterparse(options):
+    am = AnsiMarkup(**options)
+    markup = "".join(corpus)
+
+    for chunk_size in 1, 3, 100, 1 << 16:
+        res = list(am.iterparse(markup, chunk_size))
+        assert "".join(res) == am.parse(markup)
+        assert all(res) and (len(res) > 1 or chunk_size > len(markup))
+
+    lines = io.StringIO("<b>1\n2</b>\n<r>3\n")
+    out = io.StringIO()
+    out.writelines(am.iterparse(lines))
+    assert out.getvalue() == am.parse("<b>1\n2</b>\n<r>3\n")
+
+    strings = ["<b>1", am.raw("</b><r>"), "2</b>"]
+    assert "".join(am.iterparse(strings)) == am.parse(*strings)
+    assert "".join(am.iterparse(am.raw("<b>1"), 2)) == am.parse(am.raw("<b>1"))
+    assert "".join(am.iterparse([])) == "".join(am.iterparse("")) == am.parse("")
+    assert "".join(am.iterparse(am.ansistring("<b>1</b><tag>"), 2)) == am.parse(am.parse("<b>1</b><tag>"))
+
+    with raises(MismatchedTag):
+        list(AnsiMarkup(strict=True).iterparse(["<b>1", "2"]))
+
+
+@mark.parametrize("tag_sep", ["<>", "{}"])
+def test_parse_bytes(tag_sep):
+    am = AnsiMarkup(tags={"info": F.GREEN}, tag_sep=tag_sep)
+    table = str.maketrans("<>{}", tag_sep + "<>")
+
+    for markup in corpus + ["<info>é☃</info>", "<b>\xff</b>"]:
+        markup = markup.translate(table)
+        data = markup.encode("utf-8", "surrogateescape")
+        for value in (data, bytearray(data), memoryview(data)):
+            assert am.parse_bytes(value) == am.parse(markup).encode("utf-8", "surrogateescape"), markup
+            assert am.strip_bytes(value) == am.strip(markup).encode("utf-8", "surrogateescape"), markup
+
+
+def test_parse_bytes_options():
+    out = bytearray(b"> ")
+    assert AnsiMarkup().parse_bytes(b"<b>1</b>", out) is out
+    assert AnsiMarkup().strip_bytes(b"<b>2</b>", out) is out
+    assert out == b"> " + S.BRIGHT.encode() + b"1" + S.RESET_ALL.encode() + b"2"
+
+    assert AnsiMarkup(always_reset=True).parse_bytes(b"<b>1") == (S.BRIGHT + "1" + S.RESET_ALL).encode()
+    assert AnsiMarkup(minimal=True).parse_bytes(b"<b><r>1</r></b>") == b"\x1b[1;31m1\x1b[0m"
+    assert AnsiMarkup(tags={"e": "é"}).parse_bytes(b"<e>\xe9", encoding="latin-1") == b"\xe9\xe9"
+    assert AnsiMarkup().parse_bytes(b"<b\xff>1") == b"<b\xff>1"
+
+    with raises(MismatchedTag):
+        AnsiMarkup(strict=True).parse_bytes(b"<b>1")
+
+    with raises(ValueError):
+        AnsiMarkup(tag_sep="«»").parse_bytes(b"1")
+
+
+@mark.parametrize("executor", ["thread", "process"])
+def test_parse_many(executor):
+    am = AnsiMarkup(tags={"info": F.GREEN}, tag_sep="{}", always_reset=True)
+    strings = ["{b}1{/b}", "{info}2", am.raw("{b}3"), "{b}1{/b}", "4"] * 10
+
+    res = am.parse_many(strings, workers=2, executor=executor, chunksize=2)
+    assert res == [am.parse(i) for i in strings]
+
+    with raises(MismatchedTag):
+        am.parse_many(["{b}1{/b}", "{/b}"], workers=2, executor=executor)
+
+
+def test_parse_many_options():
+    am = AnsiMarkup(tags={"call": lambda: F.BLUE})
+    with raises(ValueError):
+        am.parse_many(["<call>1</call>"], executor="process")
+
+    assert am.parse_many(["<call>1</call>"], executor="thread") == [F.BLUE + "1" + S.RESET_ALL]
+
+    with raises(ValueError):
+        am.parse_many([], executor="fiber")
+
+
+@mark.parametrize("options", [{}, {"minimal": True}, {"always_reset": True}])
+def test_string_slicing(options):
+    am = AnsiMarkup(**options)
+    for markup in corpus + ["<b>1<r>2</r>3</b>", "<b>12</b>\x1b]8;;x\x1b\\<r>34</r>"]:
+        t = am.ansistring(markup)
+        assert t == am.parse(markup) == "".join(t._segments), markup
+        chars, _ = render_styles(t)
+
+        for start in range(len(t) + 1):
+            for stop in range(start, len(t) + 1):
+                res = t[start:stop]
+                assert (len(res), res.stripped) == (stop - start, t.stripped[start:stop])
+                if "\x1b]" not in markup and res is not t:
+                    assert render_styles(res) == (chars[start:stop], DEFAULT), markup
+
+        assert [t[i] for i in range(-len(t), len(t))] == [t[i : i + 1] for i in range(len(t))] * 2
+
+    t = am.ansistring("<b>1</b>2")
+    assert t[:] == t[0:] == t[-5:5] == t
+    with raises(IndexError):
+        t[2]
+    with raises(ValueError):
+        t[::2]
+
+
+def test_string_layout(am):
+    t = am.ansistring("<b>abc</b>def")
+    assert t.ljust(8) == S.BRIGHT + "abc" + S.RESET_ALL + "def  "
+    assert t.rjust(8, "-") == "--" + S.BRIGHT + "abc" + S.RESET_ALL + "def"
+    assert t.center(9, ".") == ".." + S.BRIGHT + "abc" + S.RESET_ALL + "def."
+    assert [t.center(i).stripped for i in range(4, 12)] == ["abcdef".center(i) for i in range(4, 12)]
+    assert t.ljust(3) is t and t.truncate(6) is t
+    assert repr(t.ljust(7)) == repr(str(t) + " ")
+
+    assert t.truncate(4) == S.BRIGHT + "abc" + S.RESET_ALL + "…"
+    assert t.truncate(2, "...") == ".."
+    assert t[1:].truncate(3, "") == S.BRIGHT + "bc" + S.RESET_ALL + "d"
+
+    t = am.ansistring("<r>one two <b>three four</b> five</r> six")
+    lines = t.wrap(9, initial_indent="* ", subsequent_indent="  ")
+    assert [i.stripped for i in lines] == TextWrapper(9, initial_indent="* ", subsequent_indent="  ").wrap(t.stripped)
+    assert lines[0] == "* " + F.RED + "one two" + S.RESET_ALL
+    assert lines[2] == "  \x1b[1;31mfour" + S.RESET_ALL
+    assert lines[4] == "  six"
+    assert [len(i) for i in lines] == [9, 7, 6, 6, 5]
+    assert am.ansistring("").wrap() == []
+
+    # Styles that are left open are reset, even if the string is not cut.
+    t = am.ansistring("<b>abc <r>def")
+    assert t.wrap() == [t[:]] == [S.BRIGHT + "abc " + F.RED + "def" + S.RESET_ALL]
+    assert t.wrap(4) == [S.BRIGHT + "abc" + S.RESET_ALL, "\x1b[1;31mdef" + S.RESET_ALL]
+
+    with raises(TypeError):
+        t.ljust(10, "ab")
+
+
+def test_shared_tables():
+    class Custom(AnsiMarkup):
+        def resolve_tag(self, tag):
+            return "X" if tag == "b" else super().resolve_tag(tag)
+
+    am, tagged, custom = AnsiMarkup(), AnsiMarkup(tags={"info": F.GREEN}), Custom()
+    assert am._tag_table is AnsiMarkup()._tag_table is markup.builtin_tag_table
+
+    assert tagged.parse("<info>1</info><b>2</b>") == F.GREEN + "1" + S.RESET_ALL + S.BRIGHT + "2" + S.RESET_ALL
+    assert tagged._tag_table is tagged.user_tags and tagged._shared_table is markup.builtin_tag_table
+    assert am.parse("<b>2</b><fg 200>3</fg 200>") == S.BRIGHT + "2" + S.RESET_ALL + "\x1b[38;5;200m3" + S.RESET_ALL
+    assert custom.parse("<b>2</b>") == "X2" + S.RESET_ALL
+    assert "fg 200" in markup.builtin_tag_table and markup.builtin_tag_table.get("info") is None
+
+    tagged.user_tags.clear()
+    assert tagged.parse("<info>1</info>") == "<info>1</info>"
+    am.user_tags["b"] = F.RED
+    assert am.parse("<b>2</b>") == F.RED + "2" + S.RESET_ALL
+    assert AnsiMarkup().parse("<b>2</b>") == S.BRIGHT + "2" + S.RESET_ALL
+
+    assert AnsiMarkup(tag_sep="{}").re_tag is AnsiMarkup(tag_sep=["{", "}"]).re_tag
+
+
+def test_instance_memory():
+    import tracemalloc
+
+    tags = {"info": F.GREEN, "warn": F.YELLOW}
+    tracemalloc.start()
+    plain = [AnsiMarkup() for _ in range(1000)]
+    plain_size = tracemalloc.get_traced_memory()[0]
+    tagged = [AnsiMarkup(tags=tags) for _ in range(1000)]
+    tagged_size = tracemalloc.get_traced_memory()[0] - plain_size
+    tracemalloc.stop()
+
+    # The parse cache and the tag tables are only allocated when needed, and
+    # the user tags are neither copied nor flattened until they are used.
+    assert plain[0]._user_tags is None and plain[0]._cache is None
+    assert plain[0]._tag_table is markup.builtin_tag_table
+    assert tagged[0]._user_tags is tags and tagged[0]._user_codes is None
+    assert tagged_size <= plain_size * 1.1
+
+    assert tagged[0].parse("<info>1</info>") == F.GREEN + "1" + S.RESET_ALL
+    assert tagged[0]._tag_table is tags and tagged[0]._tags_snapshot is None
+
+    assert plain[0].user_tags == {} and plain[0].parse("<b>1</b>") == S.BRIGHT + "1" + S.RESET_ALL
+    plain[0].user_tags["b"] = F.RED
+    assert plain[0].parse("<b>1</b>") == F.RED + "1" + S.RESET_ALL
+    assert plain[1].parse("<b>1</b>") == S.BRIGHT + "1" + S.RESET_ALL
+
+
+def test_string_method_lazy(am):
+    markup = am.ansistring("<b>abc</b><tag>")
+    assert "stripped" not in vars(markup)
+    assert len(markup) == 8
+    assert markup.delta == len(str(markup)) - 8 == 8
+
+    assert markup.stripped == "abc<tag>"
+    assert "stripped" in vars(markup)
+
+    markup = AnsiMarkup(always_reset=True).ansistring("<b>abc")
+    assert str(markup) == S.BRIGHT + "abc" + S.RESET_ALL
+    assert (len(markup), markup.delta) == (3, 8)
+
+
+def test_string_memory(am):
+    import tracemalloc
+
+    rows = ["<b>{0:>6}</b> <g>name-{0}</g> <fg #ff8800>{1}</fg #ff8800> padding".format(i, i % 13) for i in range(1000)]
+    tracemalloc.start()
+    strings = [am.ansistring(i) for i in rows]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # The segments of a string are only compiled once it is sliced or laid out.
+    assert "_segments" not in vars(strings[0])
+    assert size / len(strings) < 600
+    assert strings[0][1:3] == S.BRIGHT + "  " + S.RESET_ALL
+    assert "_segments" in vars(strings[0])
+
+
+def test_string_tags_changed():
+    calls = []
+    am = AnsiMarkup(tags={"x": F.RED, "call": lambda: calls.append(1) or F.BLUE})
+    t, dynamic = am.ansistring("<x>ab</x>c"), am.ansistring("<call>ab</call>c")
+    am.user_tags["x"] = F.GREEN
+    am.user_tags["call"] = F.GREEN
+
+    assert t[1:] == F.RED + "b" + S.RESET_ALL + "c"
+    assert dynamic[1:] == F.BLUE + "b" + S.RESET_ALL + "c"
+    assert calls == [1]
+
+
+def test_strip_known_tags():
+    calls = []
+    am = AnsiMarkup(tags={"call": lambda: calls.append(1) or F.BLUE})
+
+    assert am.strip("<call>1</call><b>2</r></b><tag>3</tag>") == "12<tag>3</tag>"
+    assert am.strip("</b></b><b><b>") == ""
+    assert calls == []
+
+
+def test_color(monkeypatch, tty):
+    for name in ("NO_COLOR", "FORCE_COLOR", "TERM"):
+        monkeypatch.delenv(name, raising=False)
+
+    f = io.StringIO()
+    assert (markup.stream_colors(tty), markup.stream_colors(f), markup.stream_colors(None)) == (True, False, False)
+
+    am = AnsiMarkup(color="auto")
+    am.ansiprint("<b>1</b>", am.raw("<b>"), file=tty, end="")
+    am.ansiprint("<b>1</b>", am.raw("<b>"), file=f, end="")
+    assert tty.getvalue() == S.BRIGHT + "1" + S.RESET_ALL + " <b>"
+    assert f.getvalue() == "1 <b>"
+
+    # The decision is made once per stream.
+    monkeypatch.setenv("NO_COLOR", "1")
+    assert am.colors(tty) is True
+    assert AnsiMarkup(color="auto").colors(tty) is False
+    assert AnsiMarkup(color="always").colors(f) is True
+
+    monkeypatch.setenv("NO_COLOR", "")
+    monkeypatch.setenv("FORCE_COLOR", "1")
+    assert markup.stream_colors(f) is True
+    monkeypatch.setenv("FORCE_COLOR", "0")
+    assert markup.stream_colors(tty) is False
+    monkeypatch.setenv("FORCE_COLOR", "")
+    monkeypatch.setenv("TERM", "dumb")
+    assert markup.stream_colors(tty) is False
+
+    f = io.StringIO()
+    AnsiMarkup(color="never").ansiprint("<b>1</b>", "<r>2</r>", file=f)
+    assert f.getvalue() == "1 2\n"
+
+    # Stripped markup is checked as strictly as parsed markup.
+    am, f = AnsiMarkup(color="never", strict=True), io.StringIO()
+    am.ansiprint("<b>1", am.raw("<r>"), "</b><tag>", file=f)
+    assert f.getvalue() == "1 <r> <tag>\n"
+    for args, error in (
+        (["<b>1"], MismatchedTag),
+        (["1", "</b>"], MismatchedTag),
+        (["<b><r>1</b></r>"], UnbalancedTag),
+    ):
+        with raises(error):
+            am.ansiprint(*args, file=f)
+
+    with raises(ValueError):
+        AnsiMarkup(color="sometimes")
@@ -0,0 +1,30 @@
+import json
+import os
+
+from pytest import mark
+
+import perf
+
+
+# Timings depend on the machine and its load - the comparison with the baseline
+# only runs when it is asked for.
+@mark.skipif(not os.environ.get("ANSIMARKUP_PERF"), reason="set ANSIMARKUP_PERF=1 to compare against the baseline")
+def test_perf_regressions():
+    with open(perf.baseline_path) as fh:
+        baseline = json.load(fh)
+
+    results = perf.run_suite()
+    assert set(results["results"]) == set(baseline["results"])
+
+    # Timings are noisy - only cases that are slower twice in a row fail.
+    slower = perf.compare(results, baseline)
+    if slower:
+        slower = perf.compare(perf.run_suite(names=slower), baseline)
+    assert not slower
+
+
+def test_compare():
+    baseline = {"results": {"a": {"relative": 1.0}, "b": {"relative": 1.0}}}
+    results = {"results": {"a": {"relative": 2.9}, "b": {"relative": 3.1}, "c": {"relative": 100}}}
+    assert perf.compare(results, baseline) == ["b"]
+    assert perf.compare(results, baseline, tolerance=4) == []